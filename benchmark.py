@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+"""
+Micro-benchmarks for the save codec, JSON parser and asset index
+
+Everything is run against synthetic data generated in a temp folder, so no
+Starbound install is needed. Results are written as JSON so two revisions can
+be compared:
+
+$ ./benchmark.py -o before.json
+$ git checkout <other revision>
+$ ./benchmark.py -o after.json -c before.json
+
+Startup is timed by importing the GUI in fresh interpreters with
+python -X importtime. That needs the Qt modules build.py generates, so it's
+run in the build folder (see --build-dir). The run fails if the GUI can't be
+imported there or takes longer than the startup budget.
+"""
+
+import os, sys, json, time, timeit, shutil, tempfile, platform, logging, subprocess
+from optparse import OptionParser
+
+src_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(src_dir, "starcheat"))
+# starcheat/starbound is the py-starbound submodule, the package is inside it
+# (build.py copies it up a level)
+sys.path.insert(0, os.path.join(src_dir, "starcheat", "starbound"))
+
+import saves
+
+# entity sizes are roughly the number of inventory slots and blueprints
+sizes = (10, 100, 1000)
+# number of rows in the generated asset index
+index_sizes = (100, 1000, 10000)
+# modules timed by a cold import, the last is everything the GUI loads at startup
+startup_modules = ("saves", "assets", "gui.mainwindow")
+# seconds importing the GUI may take before the run fails
+startup_budget = 1.0
+
+def new_entity(size):
+    """Return a synthetic player entity with size bag slots and blueprints."""
+    def item(i):
+        return saves.new_item("item%d" % i, i % 1000 + 1,
+                              {"shortdescription": "Item %d" % i,
+                               "level": float(i), "stats": [1.5, 2, True, None]})
+
+    return {
+        "uuid": "ffffffffffffffffffffffffffffffff",
+        "description": "synthetic benchmark player",
+        "modeType": "supernova",
+        "playTime": 1234.5,
+        "identity": {
+            "name": "Benchmark", "species": "human", "gender": "male",
+            "hairGroup": "hair", "hairType": "male1",
+            "bodyDirectives": "?replace;ffe2c5=ffc181;d9c189=d39c6c",
+            "personalityIdle": "idle.1"
+        },
+        "status": {"healthSchema": {"value": 100.0, "max": 100.0},
+                   "energySchema": {"value": 100.0, "max": 100.0}},
+        "inventory": {
+            "money": 1000,
+            "bag": [item(i) if i % 3 else None for i in range(size)],
+            "tileBag": [item(i) for i in range(size)],
+            "equipment": [None] * 12
+        },
+        "blueprints": [saves.new_item("recipe%d" % i, 1, {}) for i in range(size)],
+        "techController": {"techModules": []}
+    }
+
+def write_save(filename, entity):
+    starsave = {"entity_name": "PlayerEntity", "variant_version": 1, "data": entity}
+    save_file = open(filename, "wb")
+    save_file.write(saves.data_version.encode("utf-8"))
+    save_file.write(saves.pack_starsave(starsave))
+    save_file.close()
+
+asset_document = """{
+    // synthetic item asset, with the comments starbound allows
+    "itemName" : "item%d",
+    "rarity" : "Common",
+    "inventoryIcon" : "icon.png:chest",
+    /* block comments too */
+    "description" : "A thing // that is not a comment",
+    "shortdescription" : "Item %d",
+    "maxStack" : 1000,
+    "statusEffects" : [ { "kind" : "Glow", "amount" : 1.5 } ],
+    "frames" : [ %s ]
+}
+"""
+
+def new_asset_document(i, size=10):
+    return asset_document % (i, i, ", ".join(str(x) for x in range(size)))
+
+def new_asset_tree(folder, total):
+    """Make a folder style mod with total item assets in it."""
+    mod_folder = os.path.join(folder, "mods", "benchmark")
+    items_folder = os.path.join(mod_folder, "items", "generic")
+    os.makedirs(items_folder)
+    os.makedirs(os.path.join(folder, "assets"))
+    modinfo = open(os.path.join(mod_folder, "benchmark.modinfo"), "w")
+    modinfo.write('{"name": "benchmark", "path": "."}')
+    modinfo.close()
+    for i in range(total):
+        item_file = open(os.path.join(items_folder, "item%d.item" % i), "w")
+        item_file.write(new_asset_document(i))
+        item_file.close()
+    return folder
+
+def startup_path(build_dir):
+    """
+    Folders starcheat is imported from for the startup benchmarks, the
+    build.py output if there is one, otherwise the source tree.
+    """
+    if os.path.isfile(os.path.join(build_dir, "qt_mainwindow.py")):
+        return [build_dir]
+    return [os.path.join(src_dir, "starcheat"), os.path.join(src_dir, "starcheat", "starbound")]
+
+def import_time(module, path):
+    """
+    Import a module from the folders in path in a fresh interpreter and return
+    (seconds, imports) from -X importtime, imports being (seconds, name) of
+    each module it pulled in directly, slowest first.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(path)
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            cwd=path[0], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    output = proc.communicate()[1].decode(errors="replace")
+    if proc.returncode != 0:
+        lines = output.strip().splitlines()
+        raise ImportError(lines[-1] if len(lines) > 0 else "import %s failed" % module)
+
+    imports = []
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            # the header
+            continue
+        name = fields[2][1:]
+        # imports are indented under the one that caused them
+        if not name.startswith(" "):
+            imports.append((cumulative / 1000000, name))
+    if len(imports) == 0:
+        raise ImportError("no -X importtime output, needs python 3.7 or later")
+    return sum(x[0] for x in imports), sorted(imports, reverse=True)
+
+class Benchmarks():
+    def __init__(self, repeat, quick=False, build_dir="build"):
+        self.repeat = repeat
+        self.build_dir = build_dir
+        self.results = {}
+        self.skipped = []
+        # slowest imports of the best cold import of each startup module
+        self.startup = {}
+        self.temp = tempfile.mkdtemp(prefix="starcheat-bench-")
+        if quick:
+            global sizes, index_sizes
+            sizes = sizes[:2]
+            index_sizes = index_sizes[:2]
+
+    def time(self, name, func, number=None):
+        """Run func enough times for a stable result and record per call times."""
+        timer = timeit.Timer(func)
+        if number is None:
+            number = 1
+            while timer.timeit(number) < 0.2:
+                number *= 10
+        times = [x / number for x in timer.repeat(self.repeat, number)]
+        self.results[name] = {
+            "number": number,
+            "best": min(times),
+            "mean": sum(times) / len(times)
+        }
+        logging.info("%-40s %12.6fs", name, min(times))
+
+    def run(self):
+        try:
+            self.bench_startup()
+            self.bench_codec()
+            self.bench_saves()
+            try:
+                import assets
+            except ImportError as err:
+                self.skipped.append("assets (%s)" % err)
+                logging.warning("Skipping asset benchmarks: %s", err)
+            else:
+                self.bench_parse_json(assets)
+                self.bench_index(assets)
+        finally:
+            shutil.rmtree(self.temp, ignore_errors=True)
+
+    def bench_startup(self):
+        path = startup_path(self.build_dir)
+        logging.info("Timing imports from %s", path[0])
+        for module in startup_modules:
+            try:
+                runs = [import_time(module, path) for i in range(self.repeat)]
+            except ImportError as err:
+                self.skipped.append("import %s (%s)" % (module, err))
+                logging.warning("Skipping import %s: %s", module, err)
+                continue
+            times = [x[0] for x in runs]
+            self.results["import %s" % module] = {
+                "number": 1,
+                "best": min(times),
+                "mean": sum(times) / len(times)
+            }
+            self.startup[module] = min(runs)[1]
+            logging.info("%-40s %12.6fs", "import %s" % module, min(times))
+
+    def bench_codec(self):
+        for size in sizes:
+            entity = new_entity(size)
+            packed = saves.pack_variant(entity)
+            self.time("pack_variant[%d]" % size, lambda: saves.pack_variant(entity))
+            self.time("unpack_variant[%d]" % size, lambda: saves.unpack_variant(packed))
+
+    def bench_saves(self):
+        for size in sizes:
+            filename = os.path.join(self.temp, "bench%d.player" % size)
+            write_save(filename, new_entity(size))
+            player = saves.PlayerSave(filename)
+            self.time("PlayerSave.import_save[%d]" % size,
+                      lambda: saves.PlayerSave(filename))
+            self.time("PlayerSave.import_save(intern)[%d]" % size,
+                      lambda: saves.PlayerSave(filename, intern=True))
+            self.time("PlayerSave.import_save(untracked)[%d]" % size,
+                      lambda: saves.PlayerSave(filename, track=False))
+            self.time("PlayerSave.export_save[%d]" % size,
+                      lambda: player.export_save())
+            edited = saves.PlayerSave(filename)
+            edited.entity["inventory"]["money"] += 1
+            self.time("PlayerSave.export_save(edited)[%d]" % size,
+                      lambda: edited.export_save())
+            self.time("PlayerSave.get_name(lazy)[%d]" % size,
+                      lambda: saves.PlayerSave(filename, lazy=True).get_name())
+
+    def bench_parse_json(self, assets):
+        for size in sizes:
+            content = new_asset_document(1, size)
+            self.time("parse_json[%d]" % size,
+                      lambda: assets.parse_json(content, "/items/item.item"))
+
+    def bench_index(self, assets):
+        for total in index_sizes:
+            folder = os.path.join(self.temp, "index%d" % total)
+            new_asset_tree(folder, total)
+            db_file = os.path.join(folder, "assets.db")
+
+            def create_index():
+                db = assets.Assets(db_file, folder)
+                db.init_db()
+                for i in db.create_index():
+                    pass
+                db.db.close()
+            self.time("create_index[%d]" % total, create_index, number=1)
+
+            db = assets.Assets(db_file, folder)
+            items = db.items()
+            self.time("Assets.filter[%d]" % total,
+                      lambda: db.filter("item", "<all>", "item1"))
+            self.time("Items.get_item[%d]" % total,
+                      lambda: items.get_item("item%d" % (total - 1)))
+            db.db.close()
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=src_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def compare(results, baseline_file):
+    """Print the change in best time of each benchmark against a previous run."""
+    baseline = json.load(open(baseline_file))
+    print("%-40s %12s %12s %8s" % ("benchmark", "before", "after", "change"))
+    for name in sorted(results["results"]):
+        after = results["results"][name]["best"]
+        if name not in baseline["results"]:
+            print("%-40s %12s %12.6f %8s" % (name, "-", after, "new"))
+            continue
+        before = baseline["results"][name]["best"]
+        print("%-40s %12.6f %12.6f %+7.1f%%" % (name, before, after,
+                                               (after - before) / before * 100))
+
+def check_startup(bench, budget):
+    """
+    Return False and say why if starting the GUI couldn't be timed or is
+    over budget.
+    """
+    module = startup_modules[-1]
+    result = bench.results.get("import %s" % module)
+    if result is None:
+        reasons = [x for x in bench.skipped if x.startswith("import %s " % module)]
+        print("Could not time the startup budget: %s" % ", ".join(reasons))
+        if startup_path(bench.build_dir)[0] != bench.build_dir:
+            print("No build in %s, run build.py first or pass --build-dir" % bench.build_dir)
+        return False
+    if result["best"] <= budget:
+        return True
+    print("import %s took %.3fs, over the %.3fs startup budget. Slowest imports:" %
+          (module, result["best"], budget))
+    for seconds, name in bench.startup[module][:10]:
+        print("    %8.3fs %s" % (seconds, name))
+    return False
+
+def main():
+    parser = OptionParser(description="runs the starcheat micro-benchmarks")
+    parser.add_option("-o", "--output", dest="output", default="bench_output.json",
+                      help="write results as JSON to this file (default to bench_output.json)")
+    parser.add_option("-c", "--compare", dest="compare",
+                      help="compare results against a previous JSON output file")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+                      help="number of timing runs per benchmark (default to 5)")
+    parser.add_option("-q", "--quick", dest="quick", action="store_true",
+                      help="skip the largest input sizes")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="print each result as it finishes")
+    parser.add_option("-b", "--startup-budget", dest="startup_budget", type="float",
+                      default=startup_budget,
+                      help="most seconds importing the GUI may take (default to %s)" % startup_budget)
+    parser.add_option("--build-dir", dest="build_dir", default=os.path.join(src_dir, "build"),
+                      help="build.py output folder to time startup in (default to build)")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if options.verbose else logging.WARNING,
+                        format="%(message)s")
+    # indexing the fake tree logs plenty about missing vanilla assets
+    logging.getLogger().handlers[0].addFilter(lambda r: r.levelno != logging.ERROR)
+
+    bench = Benchmarks(options.repeat, options.quick, options.build_dir)
+    bench.run()
+
+    results = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "skipped": bench.skipped,
+        "results": bench.results
+    }
+    output = open(options.output, "w")
+    json.dump(results, output, sort_keys=True, indent=4, separators=(',', ': '))
+    output.close()
+
+    if options.compare:
+        compare(results, options.compare)
+
+    if not check_startup(bench, options.startup_budget):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
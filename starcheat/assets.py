@@ -6,14 +6,15 @@ Module for reading and indexing Starbound assets
 # deps. need to:
 # - custom exception classes
 
-import os, json, re, sqlite3, logging, random
+import os, sys, json, re, sqlite3, logging, random, hashlib, time, threading, collections
+from array import array
 from io import BytesIO
 
-from PIL import Image
-
 import starbound
 import starbound.btreedb4
 
+import saves, tracing, counters
+
 # Regular expression for comments
 comment_re = re.compile(
     '("(\\[\s\S]|[^"])*")|((^)?[^\S\n]*/(?:\*(.*?)\*/[^\S\n]*|/[^\n]*)($)?)',
@@ -23,10 +24,14 @@ comment_re = re.compile(
 ignore_assets = re.compile(".*\.(db|ds_store|ini|psd)", re.IGNORECASE)
 ignore_items = re.compile(".*\.(png|config|frames)", re.IGNORECASE)
 
+# bump this whenever the assets table changes so old snapshots are skipped
+snapshot_version = 4
+
 def parse_json(content, key):
     if key.endswith(".grapplinghook"):
         content = content.replace("[-.", "[-0.")
-    decoder = json.JSONDecoder(None,None,None,None,False,None)
+    counters.incr("json.parse")
+    decoder = json.JSONDecoder(strict=False)
     # Looking for comments
     # Allows for // inside of the " " JSON data
     content = comment_re.sub(lambda m: m.group(1) or '', content)
@@ -39,6 +44,136 @@ def load_asset_file(filename):
         content = ''.join(f.readlines())
         return parse_json(content, filename)
 
+def open_pak(path):
+    counters.incr("pak.open")
+    return starbound.open_file(path)
+
+def load_image(data):
+    """Return a PIL image from PNG data."""
+    # PIL is imported on first use like numpy below, it's slow to load and
+    # starting up doesn't need it
+    from PIL import Image
+    counters.incr("png.decode")
+    return Image.open(BytesIO(data))
+
+class CountedCursor(sqlite3.Cursor):
+    """Cursor that feeds query counts and times into the perf counters."""
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, *args)
+        finally:
+            counters.query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, *args)
+        finally:
+            counters.query(sql, time.perf_counter() - start)
+
+class CountedConnection(sqlite3.Connection):
+    def cursor(self, factory=CountedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+class AssetRow():
+    """
+    One row of the assets table. Also reads like the
+    (key, path, type, category, name, desc) tuple it replaces.
+    """
+    __slots__ = ("key", "path", "type", "category", "name", "desc")
+
+    def __init__(self, key, path, asset_type, category, name, desc):
+        self.key = key
+        self.path = path
+        self.type = asset_type
+        self.category = category
+        self.name = name
+        self.desc = desc
+
+    def astuple(self):
+        return (self.key, self.path, self.type, self.category, self.name, self.desc)
+
+    def __getitem__(self, index):
+        if type(index) is int:
+            return getattr(self, AssetRow.__slots__[index])
+        return self.astuple()[index]
+
+    def __len__(self):
+        return 6
+
+    def __iter__(self):
+        return iter(self.astuple())
+
+    def __eq__(self, other):
+        if isinstance(other, AssetRow):
+            return self.astuple() == other.astuple()
+        elif isinstance(other, tuple):
+            return self.astuple() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "AssetRow%r" % (self.astuple(),)
+
+class AssetRows():
+    """
+    Read only list of AssetRows stored by column.
+
+    Keys, names and descriptions are kept in plain lists. Paths, types and
+    categories only have a few distinct values, so each is stored once and
+    rows hold an index to it in an array. Rows are built when they're read.
+    """
+    def __init__(self, rows=()):
+        self.keys = []
+        self.names = []
+        self.descs = []
+        self.strings = []
+        self.string_ids = {}
+        self.paths = array("I")
+        self.types = array("I")
+        self.categories = array("I")
+        for row in rows:
+            self.append(row)
+
+    def string_id(self, string):
+        try:
+            return self.string_ids[string]
+        except KeyError:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(sys.intern(string))
+            return len(self.strings) - 1
+
+    def append(self, row):
+        self.keys.append(row[0])
+        self.paths.append(self.string_id(row[1]))
+        self.types.append(self.string_id(row[2]))
+        self.categories.append(self.string_id(row[3]))
+        self.names.append(row[4])
+        self.descs.append(row[5])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return [self[i] for i in range(*index.indices(len(self)))]
+        strings = self.strings
+        return AssetRow(self.keys[index], strings[self.paths[index]],
+                        strings[self.types[index]], strings[self.categories[index]],
+                        self.names[index], self.descs[index])
+
+    def __iter__(self):
+        for i in range(len(self.keys)):
+            yield self[i]
+
 def read_default_color(species_data):
     color = []
     if type(species_data[0]) is str:
@@ -61,14 +196,74 @@ def asset_category(keyStr):
 class Assets():
     def __init__(self, db_file, starbound_folder):
         self.starbound_folder = starbound_folder
-        self.db = sqlite3.connect(db_file)
+        self.db = sqlite3.connect(db_file, factory=CountedConnection)
         self.vanilla_assets = os.path.join(self.starbound_folder, "assets", "packed.pak")
+        # source path: sources table id
+        self.source_ids = None
 
     def init_db(self):
         c = self.db.cursor()
+        # every pak, modpak or mod folder assets were indexed from, the other
+        # tables refer to these by id instead of repeating the path
+        c.execute("drop table if exists sources")
+        c.execute("""create table sources
+        (id integer primary key, path text unique, kind text, load_order integer,
+        fingerprint text, asset_count integer, index_time real)""")
         c.execute("drop table if exists assets")
         c.execute("""create table assets
-        (key text, path text, type text, category text, name text, desc text)""")
+        (key text, source integer, type text, category text, name text, desc text)""")
+        c.execute("drop table if exists frames")
+        c.execute("""create table frames
+        (key text, source integer, name text, x1 integer, y1 integer, x2 integer, y2 integer)""")
+        c.execute("create index frames_lookup on frames (key, name)")
+        c.execute("drop table if exists items")
+        c.execute("""create table items
+        (name text, key text, source integer, desc text, icon text, icon_frame text,
+        image text, max_stack integer, rarity text)""")
+        c.execute("create index items_lookup on items (name)")
+        self.db.commit()
+        self.source_ids = None
+
+    def source_kind(self, path):
+        if path == self.vanilla_assets:
+            return "vanilla"
+        elif path.endswith(".modpak"):
+            return "modpak"
+        elif os.path.isdir(path):
+            return "folder"
+        else:
+            return "pak"
+
+    def source_fingerprint(self, path):
+        """Return a string that changes when a source is modified."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+        return "%d-%d" % (stat.st_size, stat.st_mtime)
+
+    def source_id(self, path):
+        """Return the sources table id of an asset path, adding it if it's new."""
+        if self.source_ids is None:
+            c = self.db.cursor()
+            c.execute("select path, id from sources")
+            self.source_ids = dict(c.fetchall())
+        try:
+            return self.source_ids[path]
+        except KeyError:
+            pass
+
+        c = self.db.cursor()
+        c.execute("insert into sources values (null, ?, ?, ?, ?, 0, ?)",
+                  (path, self.source_kind(path), len(self.source_ids),
+                   self.source_fingerprint(path), time.time()))
+        self.source_ids[path] = c.lastrowid
+        return c.lastrowid
+
+    def update_source_counts(self):
+        c = self.db.cursor()
+        c.execute("""update sources set asset_count =
+        (select count(*) from assets where assets.source = sources.id)""")
         self.db.commit()
 
     def total_indexed(self):
@@ -80,8 +275,8 @@ class Assets():
             return 0
         return c.fetchone()[0]
 
-    def create_index(self, asset_files=False):
-        if not asset_files:
+    def create_index(self, asset_files=None):
+        if asset_files is None:
             asset_files = self.find_assets()
 
         blueprints = Blueprints(self)
@@ -89,24 +284,34 @@ class Assets():
         species = Species(self)
         monsters = Monsters(self)
         techs = Techs(self)
+        frames = Frames(self)
 
         new_index_query = "insert into assets values (?, ?, ?, ?, ?, ?)"
+        new_frame_query = "insert into frames values (?, ?, ?, ?, ?, ?, ?)"
+        new_item_query = "insert into items values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
         c = self.db.cursor()
-
         for asset in asset_files:
             yield (asset[0], asset[1])
 
             tmp_data = None
+            source = self.source_id(asset[1])
 
             if asset_category(asset[0]) != '':
                 if asset[0].endswith(".png"):
                     tmp_data = (asset[0], asset[1], "image", "", "", "")
+                elif frames.is_frames(asset[0]):
+                    c.executemany(new_frame_query, [(x[0], source) + x[2:]
+                                                    for x in frames.index_data(asset)])
                 elif blueprints.is_blueprint(asset[0]):
                     tmp_data = blueprints.index_data(asset)
                 elif species.is_species(asset[0]):
                     tmp_data = species.index_data(asset)
                 elif items.is_item(asset[0]):
-                    tmp_data = items.index_data(asset)
+                    indexed = items.index_data(asset)
+                    if indexed != None:
+                        tmp_data = indexed[0]
+                        meta = indexed[1]
+                        c.execute(new_item_query, meta[:2] + (source,) + meta[3:])
                 elif monsters.is_monster(asset[0]):
                     tmp_data = monsters.index_data(asset)
                 elif techs.is_tech(asset[0]):
@@ -115,9 +320,10 @@ class Assets():
                 logging.warning("Skipping invalid asset (no file extension) %s in %s" % (asset[0], asset[1]))
 
             if tmp_data != None:
-                c.execute(new_index_query, tmp_data)
+                c.execute(new_index_query, (tmp_data[0], source) + tmp_data[2:])
 
         self.db.commit()
+        self.update_source_counts()
 
     def find_assets(self):
         """Scan all Starbound assets and return key/file list.
@@ -129,7 +335,12 @@ class Assets():
         vanilla_path = os.path.join(self.starbound_folder, "assets")
         vanilla_assets = self.scan_asset_folder(vanilla_path)
         [index.append(x) for x in vanilla_assets]
+        [index.append(x) for x in self.find_mod_assets()]
+        return index
 
+    def find_mod_assets(self):
+        """Scan only the installed mods and return key/file list."""
+        index = []
         mods_path = os.path.join(self.starbound_folder, "mods")
         if not os.path.isdir(mods_path):
             return index
@@ -146,7 +357,7 @@ class Assets():
 
     def scan_modpak(self, modpak):
         # TODO: may need support for reading the mod folder from the pakinfo file
-        db = starbound.open_file(modpak)
+        db = open_pak(modpak)
         index = [(x, modpak) for x in db.get_index()]
         return index
 
@@ -154,7 +365,7 @@ class Assets():
         pak_path = os.path.join(folder, "packed.pak")
 
         if os.path.isfile(pak_path):
-            db = starbound.open_file(pak_path)
+            db = open_pak(pak_path)
             index = [(x, pak_path) for x in db.get_index()]
             return index
         else:
@@ -188,7 +399,7 @@ class Assets():
             elif found_mod_info and self.is_packed_file(mod_assets):
                 # TODO: make a .pak scanner function that works for vanilla and mods
                 pak_path = os.path.normpath(mod_assets)
-                db = starbound.open_file(pak_path)
+                db = open_pak(pak_path)
                 for x in db.get_index():
                     # removes thumbs.db etc from user pak files
                     if re.match(ignore_assets, x) == None:
@@ -207,6 +418,105 @@ class Assets():
             return index
 
 
+    def vanilla_digest(self):
+        """
+        Return a digest of the vanilla packed.pak key index and file size, or
+        None if there is no vanilla pak to snapshot.
+        """
+        if not self.is_packed_file(self.vanilla_assets):
+            return None
+
+        db = open_pak(self.vanilla_assets)
+        digest = hashlib.sha1()
+        digest.update(str(os.path.getsize(self.vanilla_assets)).encode("utf-8"))
+        for key in sorted(db.get_index()):
+            digest.update(key.encode("utf-8") + b"\x00")
+        return digest.hexdigest()
+
+    def snapshot_info(self, filename):
+        """Return the (digest, version) a snapshot file was tagged with."""
+        snapshot = sqlite3.connect(filename)
+        try:
+            c = snapshot.cursor()
+            c.execute("select digest, version from info")
+            return c.fetchone()
+        except sqlite3.DatabaseError:
+            logging.exception("Unable to read index snapshot %s", filename)
+            return None
+        finally:
+            snapshot.close()
+
+    def find_snapshot(self, folder):
+        """Return a snapshot file in folder matching the vanilla pak, if any."""
+        digest = self.vanilla_digest()
+        if digest is None:
+            return None
+
+        filename = os.path.join(folder, digest + ".db")
+        if not os.path.isfile(filename):
+            return None
+
+        if self.snapshot_info(filename) != (digest, snapshot_version):
+            logging.info("Ignoring outdated index snapshot %s", filename)
+            return None
+        return filename
+
+    def export_snapshot(self, folder):
+        """
+        Write the vanilla part of the index to a portable snapshot file in
+        folder, named after the vanilla pak digest. Return the filename.
+        """
+        digest = self.vanilla_digest()
+        if digest is None:
+            return None
+
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+        filename = os.path.join(folder, digest + ".db")
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+        c = self.db.cursor()
+        c.execute("attach database ? as snapshot", (filename,))
+        try:
+            c.execute("create table snapshot.info (digest text, version integer)")
+            c.execute("insert into snapshot.info values (?, ?)", (digest, snapshot_version))
+            # source ids are machine specific, they get filled back in on import
+            source = self.source_id(self.vanilla_assets)
+            c.execute("""create table snapshot.assets as
+            select key, type, category, name, desc from assets
+            where source = ?""", (source,))
+            c.execute("""create table snapshot.frames as
+            select key, name, x1, y1, x2, y2 from frames
+            where source = ?""", (source,))
+            c.execute("""create table snapshot.items as
+            select name, key, desc, icon, icon_frame, image,
+            max_stack, rarity from items where source = ?""", (source,))
+            self.db.commit()
+        finally:
+            c.execute("detach database snapshot")
+        return filename
+
+    def import_snapshot(self, filename):
+        """Load the vanilla index rows from a snapshot file."""
+        source = self.source_id(self.vanilla_assets)
+        c = self.db.cursor()
+        c.execute("attach database ? as snapshot", (filename,))
+        try:
+            c.execute("""insert into assets
+            select key, ?, type, category, name, desc from snapshot.assets""",
+                      (source,))
+            c.execute("""insert into frames
+            select key, ?, name, x1, y1, x2, y2 from snapshot.frames""",
+                      (source,))
+            c.execute("""insert into items
+            select name, key, ?, desc, icon, icon_frame, image, max_stack,
+            rarity from snapshot.items""", (source,))
+            self.db.commit()
+        finally:
+            c.execute("detach database snapshot")
+        self.update_source_counts()
+
     def is_packed_file(self, path):
         """
             Returns true if the asset path is a file (will be assuming from the index that it is a packed type)
@@ -214,10 +524,13 @@ class Assets():
         """
         return os.path.isfile(path)
 
+    @tracing.traced
     def read(self, key, path, image=False):
+        counters.incr("asset.read")
+        counters.incr("asset.read:" + path.replace(self.starbound_folder, ""))
         if self.is_packed_file(path):
             key = key.lower()
-            db = starbound.open_file(path)
+            db = open_pak(path)
 
             try:
                 data = db.get(key)
@@ -272,10 +585,15 @@ class Assets():
     def techs(self):
         return Techs(self)
 
+    def frames(self):
+        return Frames(self)
+
     def get_all(self, asset_type):
-        c = self.assets.db.cursor()
-        c.execute("select * from assets where type = ? order by name collate nocase", (asset_type,))
-        return c.fetchall()
+        c = self.db.cursor()
+        c.execute("""select a.key, s.path, a.type, a.category, a.name, a.desc
+        from assets a join sources s on s.id = a.source
+        where a.type = ? order by a.name collate nocase""", (asset_type,))
+        return AssetRows(c)
 
     def get_categories(self, asset_type):
         c = self.assets.db.cursor()
@@ -287,11 +605,12 @@ class Assets():
             category = "%"
         name = "%" + name + "%"
         c = self.db.cursor()
-        q = """select * from assets where type = ? and category like ?
-        and (name like ? or desc like ?) order by desc, name collate nocase"""
+        q = """select a.key, s.path, a.type, a.category, a.name, a.desc
+        from assets a join sources s on s.id = a.source
+        where a.type = ? and a.category like ? and (a.name like ? or a.desc like ?)
+        order by a.desc, a.name collate nocase"""
         c.execute(q, (asset_type, category, name, name))
-        result = c.fetchall()
-        return result
+        return AssetRows(c)
 
     def get_total(self, asset_type):
         c = self.assets.db.cursor()
@@ -303,9 +622,42 @@ class Assets():
 
     def get_mods(self):
         """Return a list of all unique mod paths."""
+        return [x[0] for x in self.get_sources(mods_only=True)]
+
+    def generation(self):
+        """
+        Return a value that changes whenever the index is rebuilt, for caches
+        of things read from the assets.
+        """
         c = self.db.cursor()
-        c.execute("select distinct path from assets order by category")
-        return [x[0].replace(self.starbound_folder,"") for x in c.fetchall()][1:]
+        try:
+            c.execute("select count(*), max(index_time) from sources")
+        except sqlite3.OperationalError:
+            return None
+        return c.fetchone()
+
+    def get_sources(self, mods_only=False):
+        """
+        Return (path, kind, asset count, index time) of every indexed source
+        in load order, paths relative to the Starbound folder.
+        """
+        c = self.db.cursor()
+        q = "select path, kind, asset_count, index_time from sources"
+        if mods_only:
+            q += " where kind != 'vanilla'"
+        c.execute(q + " order by load_order")
+        return [(x[0].replace(self.starbound_folder, ""),) + x[1:] for x in c.fetchall()]
+
+    def get_source_stats(self):
+        """Return {source path: {asset type: count}}, paths as in get_sources."""
+        c = self.db.cursor()
+        c.execute("""select s.path, a.type, count(*) from assets a
+        join sources s on s.id = a.source group by a.source, a.type""")
+        stats = {}
+        for path, asset_type, count in c.fetchall():
+            path = path.replace(self.starbound_folder, "")
+            stats.setdefault(path, {})[asset_type] = count
+        return stats
 
 class Blueprints():
     def __init__(self, assets):
@@ -336,9 +688,7 @@ class Blueprints():
 
     def get_all_blueprints(self):
         """Return a list of every indexed blueprints."""
-        c = self.assets.db.cursor()
-        c.execute("select * from assets where type = 'blueprint' order by name collate nocase")
-        return c.fetchall()
+        return self.assets.get_all("blueprint")
 
     def get_categories(self):
         """Return a list of all unique blueprint categories."""
@@ -368,6 +718,7 @@ class Items():
             return False
 
     def index_data(self, asset):
+        """Return the assets row and items metadata row for an item asset."""
         key = asset[0]
         path = asset[1]
         asset_type = "item"
@@ -394,7 +745,40 @@ class Items():
         else:
             if key.endswith(".techitem"):
                 name = name + "-chip"
-            return (key, path, asset_type, category, name, desc)
+            return ((key, path, asset_type, category, name, desc),
+                    self.meta_data(key, path, name, desc, asset_data))
+
+    def resolve_image(self, key, image):
+        """Return an absolute image key and frame name from an item image value."""
+        if type(image) is not str or image == "":
+            # generated items have a list of drawables instead
+            return "", ""
+        image = image.split(":")
+        if image[0] == "":
+            # only a frame (":idle"), there's no image to point it at
+            return "", ""
+        if not image[0].startswith("/"):
+            image[0] = os.path.dirname(key) + "/" + image[0]
+        if len(image) < 2:
+            return image[0], ""
+        return image[0], image[1].split("?")[0]
+
+    def meta_data(self, key, path, name, desc, asset_data):
+        """Return the items table row used to draw an item without its asset."""
+        icon = self.resolve_image(key, asset_data.get("inventoryIcon"))
+        image = self.resolve_image(key, asset_data.get("image"))
+
+        try:
+            max_stack = int(asset_data["maxStack"])
+        except (KeyError, TypeError, ValueError):
+            max_stack = None
+
+        rarity = asset_data.get("rarity", "")
+        if type(rarity) is not str:
+            rarity = ""
+
+        return (name, key, path, desc, icon[0], icon[1], image[0],
+                max_stack, rarity.lower())
 
     def filter_items(self, category, name):
         """Search for indexed items based on name and category."""
@@ -402,9 +786,7 @@ class Items():
 
     def get_all_items(self):
         """Return a list of every indexed item."""
-        c = self.assets.db.cursor()
-        c.execute("select * from assets where type = 'item' order by name collate nocase")
-        return c.fetchall()
+        return self.assets.get_all("item")
 
     def get_item(self, name):
         """
@@ -412,81 +794,87 @@ class Items():
         parsed asset file and location.
         """
         c = self.assets.db.cursor()
-        c.execute("select key, path, desc from assets where type = 'item' and name = ?", (name,))
+        c.execute("""select a.key, s.path, a.desc from assets a join sources s on s.id = a.source
+        where a.type = 'item' and a.name = ?""", (name,))
         meta = c.fetchone()
         item = self.assets.read(meta[0], meta[1])
         return item, meta[0], meta[1], meta[2]
 
+    def get_item_meta(self, name):
+        """
+        Return the indexed metadata row of an item without reading its asset:
+        (name, key, path, desc, icon, icon frame, image, max stack, rarity)
+        """
+        c = self.assets.db.cursor()
+        c.execute("""select i.name, i.key, s.path, i.desc, i.icon, i.icon_frame, i.image,
+        i.max_stack, i.rarity from items i join sources s on s.id = i.source
+        where i.name = ?""", (name,))
+        return c.fetchone()
+
     def get_categories(self):
         """Return a list of all unique indexed item categories."""
         c = self.assets.db.cursor()
         c.execute("select distinct category from assets where type = 'item' order by category")
         return c.fetchall()
 
-    def get_item_icon(self, name):
-        """Return the path and spritesheet offset of a given item name."""
-        try:
-            item = self.get_item(name)
-            icon_file = item[0]["inventoryIcon"]
-            icon = icon_file.split(':')
-            if len(icon) < 2:
-                icon = [icon[0], 0]
-        except (TypeError, KeyError):
+    def get_item_icon(self, name, meta=None):
+        """Return the cropped inventory icon image of a given item name."""
+        if meta is None:
+            meta = self.get_item_meta(name)
+        if meta is None or meta[4] == "":
             return None
 
-        if icon[0][0] != "/":
-            icon[0] = os.path.dirname(item[1]) + "/" + icon[0]
-
-        icon_data = self.assets.read(icon[0], item[2], image=True)
+        icon_data = self.assets.read(meta[4], meta[2], image=True)
         if icon_data == None:
             return None
 
-        item_icon = Image.open(BytesIO(icon_data))
+        item_icon = load_image(icon_data)
 
-        icon_type = str(icon[1])
-        if icon_type.startswith("chest"):
+        icon_type = meta[5]
+        frame = None
+        if icon_type != "":
+            frame = self.assets.frames().get_frame(meta[4], icon_type, meta[2])
+        if frame is not None:
+            item_icon = item_icon.crop(frame)
+        # no .frames entry, fall back to the vanilla armor sheet layout
+        elif icon_type.startswith("chest"):
             item_icon = item_icon.crop((16, 0, 16+16, 16))
         elif icon_type.startswith("pants"):
             item_icon = item_icon.crop((32, 0, 32+16, 16))
         else:
             item_icon = item_icon.crop((0, 0, 16, 16))
 
-        inv_icon = Image.new("RGBA", (16,16))
+        from PIL import Image
+        inv_icon = Image.new("RGBA", item_icon.size)
         inv_icon.paste(item_icon)
         return inv_icon
 
-    def get_item_image(self, name):
+    def get_item_image(self, name, meta=None):
         """Return a vaild item image path for given item name."""
         # TODO: support for frame selectors
         # TODO: support for generated item images
         if name == "generatedsword":
-            return Image.open(BytesIO(self.sword_icon())).convert("RGBA")
+            return load_image(self.sword_icon()).convert("RGBA")
         elif name == "generatedshield":
-            return Image.open(BytesIO(self.shield_icon())).convert("RGBA")
+            return load_image(self.shield_icon()).convert("RGBA")
         elif name == "generatedgun":
-            return Image.open(BytesIO(self.sword_icon())).convert("RGBA")
+            return load_image(self.sword_icon()).convert("RGBA")
         elif name == "sapling":
-            return Image.open(BytesIO(self.sapling_icon())).convert("RGBA")
+            return load_image(self.sapling_icon()).convert("RGBA")
 
-        try:
-            item = self.get_item(name)
-            icon_file = item[0]["image"]
-            icon = icon_file.split(':')
-            icon = icon[0]
-        except (KeyError, TypeError):
+        if meta is None:
+            meta = self.get_item_meta(name)
+        if meta is None or meta[6] == "":
             logging.warning("No image key for "+name)
             return None
 
-        if icon[0] != "/":
-            icon = os.path.dirname(item[1]) + "/" + icon
-
-        icon_data = self.assets.read(icon, item[2], image=True)
+        icon_data = self.assets.read(meta[6], meta[2], image=True)
 
         if icon_data == None:
-            logging.warning("Unable to read %s from %s" % (icon, item[2]))
+            logging.warning("Unable to read %s from %s" % (meta[6], meta[2]))
             return None
 
-        item_image = Image.open(BytesIO(icon_data)).convert("RGBA")
+        item_image = load_image(icon_data).convert("RGBA")
         return item_image
 
     def missing_icon(self):
@@ -738,6 +1126,115 @@ class Items():
 
         return filledcapturepod
 
+def parse_color(color):
+    """Return the (r, g, b, a) of a directive hex color, or None if it isn't one."""
+    try:
+        value = bytes.fromhex(color)
+    except ValueError:
+        return None
+    if len(value) == 3:
+        return tuple(value) + (255,)
+    elif len(value) == 4:
+        return tuple(value)
+    return None
+
+def directive_palette(directives):
+    """
+    Return {from rgba: to rgba} for a string of ?replace directives. Each
+    ?replace applies to the result of the ones before it, so they're
+    folded into one palette.
+    """
+    palette = {}
+    for group in saves.unpack_color_directives(directives):
+        step = {}
+        for pair in group:
+            if len(pair) != 2:
+                continue
+            old, new = parse_color(pair[0]), parse_color(pair[1])
+            if old is not None and new is not None:
+                step[old] = new
+        palette = {k: step.get(v, v) for k, v in palette.items()}
+        for k, v in step.items():
+            palette.setdefault(k, v)
+    return palette
+
+# numpy takes a while to import and is only needed once something gets
+# recoloured, so it's loaded on first use. None if it isn't installed
+numpy = None
+numpy_loaded = False
+
+def load_numpy():
+    global numpy, numpy_loaded
+    if not numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            # recolouring falls back to plain python, still quick on preview sized sprites
+            numpy = None
+        numpy_loaded = True
+    return numpy
+
+def recolor(image, palette):
+    """Return a copy of an image with every pixel exactly matching a palette color replaced."""
+    if image is None or len(palette) == 0:
+        return image
+    counters.incr("image.recolor")
+    from PIL import Image
+    image = image.convert("RGBA")
+
+    if load_numpy() is None:
+        recolored = Image.new("RGBA", image.size)
+        recolored.putdata([palette.get(x, x) for x in image.getdata()])
+        return recolored
+
+    # compare whole pixels as one uint32 each, and look them up in the
+    # sorted palette with a binary search
+    pixels = numpy.array(image, dtype=numpy.uint8)
+    packed = pixels.view(numpy.uint32)[..., 0]
+    keys = numpy.array(list(palette.keys()), dtype=numpy.uint8).view(numpy.uint32)[:, 0]
+    values = numpy.array(list(palette.values()), dtype=numpy.uint8).view(numpy.uint32)[:, 0]
+    order = numpy.argsort(keys)
+    keys = keys[order]
+    values = values[order]
+    index = numpy.searchsorted(keys, packed).clip(0, len(keys) - 1)
+    found = keys[index] == packed
+    packed[found] = values[index[found]]
+    return Image.fromarray(pixels, "RGBA")
+
+class LayerCache():
+    """
+    Cropped sprite images shared by every player render, so changing one part
+    of an appearance only reads that layer again. Safe to use from render
+    threads, and emptied whenever the asset index changes.
+    """
+    def __init__(self, size=128):
+        self.size = size
+        self.layers = collections.OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def get(self, db, key, read):
+        """Return the cached layer for key, calling read() to make it if needed."""
+        generation = db.generation()
+        key = (db.starbound_folder,) + key
+        with self.lock:
+            if generation != self.generation:
+                self.layers.clear()
+                self.generation = generation
+            if key in self.layers:
+                self.layers.move_to_end(key)
+                counters.cache_hit("layers")
+                return self.layers[key]
+        counters.cache_miss("layers")
+        layer = read()
+        with self.lock:
+            self.layers[key] = layer
+            while len(self.layers) > self.size:
+                self.layers.popitem(last=False)
+        return layer
+
+layer_cache = LayerCache()
+
 class Species():
     def __init__(self, assets):
         self.assets = assets
@@ -785,7 +1282,8 @@ class Species():
     def get_species(self, name):
         """Look up a species from the index and return contents of species files."""
         c = self.assets.db.cursor()
-        c.execute("select * from assets where type = 'species' and name = ?", (name.lower(),))
+        c.execute("""select a.key, s.path from assets a join sources s on s.id = a.source
+        where a.type = 'species' and a.name = ?""", (name.lower(),))
         species = c.fetchone()
         if species is None:
             # species is not indexed
@@ -885,28 +1383,34 @@ class Species():
             logging.warning("No race set on player")
             return None
 
+    @tracing.traced
     def render_player(self, player):
-        name = player.get_race()
-        gender = player.get_gender()
-        asset_loc = self.get_species(name)[0][1]
-
-        body_sprites = self.assets.read("/humanoid/%s/%sbody.png" % (name, gender),
-                                        asset_loc, True)
-        frontarm_sprites = self.assets.read("/humanoid/%s/frontarm.png" % name,
-                                            asset_loc, True)
-        backarm_sprites = self.assets.read("/humanoid/%s/backarm.png" % name,
-                                            asset_loc, True)
-        head_sprites = self.assets.read("/humanoid/%s/%shead.png" % (name, gender),
-                                        asset_loc, True)
-
-        body_img = Image.open(BytesIO(body_sprites)).crop((43, 0, 86, 43))
-        frontarm_img = Image.open(BytesIO(frontarm_sprites)).crop((43, 0, 86, 43))
-        backarm_img = Image.open(BytesIO(backarm_sprites)).crop((43, 0, 86, 43))
-        head_img = Image.open(BytesIO(head_sprites)).crop((43, 0, 86, 43))
-
-        hair = player.get_hair()
-        hair_img = self.get_hair_image(name, hair[0], hair[1], gender)
+        return self.render_appearance(player.get_race(), player.get_gender(), player.get_hair(),
+                                      saves.pack_color_directives(player.get_body_directives()),
+                                      saves.pack_color_directives(player.get_hair_directives()))
 
+    def render_appearance(self, name, gender, hair, body_directives="", hair_directives=""):
+        """
+        Return a preview image of a species, gender and (hair group, hair type),
+        recoloured by the body and hair ?replace directives.
+        """
+        body_key = ("body", name, gender)
+        hair_key = ("hair", name, gender) + tuple(hair)
+        body_layers = layer_cache.get(self.assets, body_key,
+                                      lambda: self.body_layers(name, gender))
+        hair_img = layer_cache.get(self.assets, hair_key,
+                                   lambda: self.get_hair_image(name, hair[0], hair[1], gender))
+
+        # recoloured layers are cached per set of directives too
+        def recolor_body():
+            palette = directive_palette(body_directives)
+            return tuple(recolor(x, palette) for x in body_layers)
+        backarm_img, head_img, body_img, frontarm_img = layer_cache.get(
+            self.assets, body_key + (body_directives,), recolor_body)
+        hair_img = layer_cache.get(self.assets, hair_key + (hair_directives,),
+                                   lambda: recolor(hair_img, directive_palette(hair_directives)))
+
+        from PIL import Image
         base = Image.new("RGBA", (43, 43))
 
         base.paste(backarm_img)
@@ -923,8 +1427,39 @@ class Species():
 
         return base
 
+    def body_layers(self, name, gender):
+        """Return the back arm, head, body and front arm images of a species."""
+        asset_loc = self.get_species(name)[0][1]
+
+        body_sprites = self.assets.read("/humanoid/%s/%sbody.png" % (name, gender),
+                                        asset_loc, True)
+        frontarm_sprites = self.assets.read("/humanoid/%s/frontarm.png" % name,
+                                            asset_loc, True)
+        backarm_sprites = self.assets.read("/humanoid/%s/backarm.png" % name,
+                                            asset_loc, True)
+        head_sprites = self.assets.read("/humanoid/%s/%shead.png" % (name, gender),
+                                        asset_loc, True)
+
+        body_img = self.crop_sprite(body_sprites, "/humanoid/%s/%sbody.png" % (name, gender),
+                                    asset_loc, "idle.1")
+        frontarm_img = self.crop_sprite(frontarm_sprites, "/humanoid/%s/frontarm.png" % name,
+                                        asset_loc, "idle.1")
+        backarm_img = self.crop_sprite(backarm_sprites, "/humanoid/%s/backarm.png" % name,
+                                       asset_loc, "idle.1")
+        head_img = self.crop_sprite(head_sprites, "/humanoid/%s/%shead.png" % (name, gender),
+                                    asset_loc, "normal")
+
+        return backarm_img, head_img, body_img, frontarm_img
+
+    def crop_sprite(self, sprites, key, path, frame):
+        """Crop a single frame out of humanoid spritesheet image data."""
+        box = self.assets.frames().get_frame(key, frame, path)
+        if box is None:
+            # standard humanoid sheets are a grid of 43x43 frames
+            box = (43, 0, 86, 43)
+        return load_image(sprites).crop(box)
+
     def get_hair_image(self, name, hair_type, hair_group, gender):
-        # TODO: bbox is from .frame file, need a way to read them still
         species = self.get_species(name.lower())
 
         # BUG: this will break for species mods on windows maybe?
@@ -932,7 +1467,7 @@ class Species():
 
         try:
             image = self.assets.read(image_path, species[0][1], image=True)
-            return Image.open(BytesIO(image)).crop((43, 0, 86, 43))
+            return self.crop_sprite(image, image_path, species[0][1], "normal")
         except OSError:
             logging.exception("Missing hair image: %s", image_path)
             return
@@ -1024,7 +1559,8 @@ class Techs():
 
     def get_tech(self, name):
         c = self.assets.db.cursor()
-        c.execute("select key, path from assets where type = 'tech' and name = ?", (name,))
+        c.execute("""select a.key, s.path from assets a join sources s on s.id = a.source
+        where a.type = 'tech' and a.name = ?""", (name,))
         tech = c.fetchone()
         info = self.assets.read(tech[0]+"item", tech[1])
 
@@ -1033,7 +1569,87 @@ class Techs():
         if icon is None:
             icon = self.assets.items().missing_icon()
 
-        return info, Image.open(BytesIO(icon)).convert("RGBA"), tech[0]
+        return info, load_image(icon).convert("RGBA"), tech[0]
+
+class Frames():
+    def __init__(self, assets):
+        self.assets = assets
+        self.starbound_folder = assets.starbound_folder
+
+    def is_frames(self, key):
+        if key.endswith(".frames"):
+            return True
+        else:
+            return False
+
+    def index_data(self, asset):
+        """Return a frames table row for every frame and alias in a .frames file."""
+        key = asset[0].replace("\\", "/")
+        path = asset[1]
+        asset_data = self.assets.read(asset[0], path)
+
+        if asset_data == None: return []
+
+        frames = {}
+        try:
+            if "frameGrid" in asset_data:
+                grid = asset_data["frameGrid"]
+                width, height = grid["size"]
+                begin = grid.get("begin", (0, 0))
+                for y, row in enumerate(grid.get("names", [])):
+                    for x, frame in enumerate(row):
+                        if frame is None:
+                            continue
+                        x1 = begin[0] + x * width
+                        y1 = begin[1] + y * height
+                        frames[frame] = (x1, y1, x1 + width, y1 + height)
+
+            if "frameList" in asset_data:
+                for frame, rect in asset_data["frameList"].items():
+                    frames[frame] = tuple(rect)
+
+            for alias, frame in asset_data.get("aliases", {}).items():
+                if frame in frames:
+                    frames[alias] = frames[frame]
+        except (KeyError, TypeError, ValueError):
+            logging.warning("Invalid frames asset %s in %s" % (key, path))
+            return []
+
+        return [(key, path, str(frame)) + tuple(int(i) for i in rect)
+                for frame, rect in frames.items()]
+
+    def frames_keys(self, image_key):
+        """
+        Return the .frames keys that may describe an image, in the order the
+        game checks them: <image>.frames, then default.frames in each folder
+        up to the root.
+        """
+        image_key = image_key.replace("\\", "/")
+        keys = [os.path.splitext(image_key)[0] + ".frames"]
+        folder = os.path.dirname(image_key)
+        while True:
+            keys.append(folder.rstrip("/") + "/default.frames")
+            if folder in ("/", ""):
+                break
+            folder = os.path.dirname(folder)
+        return keys
+
+    def get_frame(self, image_key, frame, path):
+        """
+        Return the (x1, y1, x2, y2) crop box of a named frame in an image, or
+        None if no indexed .frames file defines it.
+        """
+        keys = self.frames_keys(image_key)
+        c = self.assets.db.cursor()
+        q = """select f.key, s.path, f.x1, f.y1, f.x2, f.y2 from frames f
+        join sources s on s.id = f.source where f.name = ? and f.key in (%s)"""
+        c.execute(q % ",".join("?" * len(keys)), [str(frame)] + keys)
+        found = c.fetchall()
+        if len(found) == 0:
+            return None
+        # nearest .frames file wins, preferring the same source as the image
+        found.sort(key=lambda x: (keys.index(x[0]), x[1] != path))
+        return found[0][2:]
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+"""
+Deduplicated save backups
+
+Files are split into variable sized chunks where the content itself decides
+the cut points (a rolling gear hash), so an edit only changes the chunks
+around it. Each chunk is stored once, zlib compressed and named by its SHA-1
+under <backup folder>/chunks. Every backed up file gets a small JSON history
+listing its versions as chunk lists, which is all listing or restoring needs
+to read. Histories are named after the file and a hash of its full path, so
+saves with the same name in different folders don't share one.
+
+Several processes can back up to the same store (batch.py does), writing a
+version and collecting unused chunks both hold a lock file for the store.
+
+From the command line:
+$ python ./backups.py list <backup folder> [.player file]
+$ python ./backups.py restore <backup folder> <.player file> <version>
+"""
+
+import os, sys, json, time, zlib, hashlib, logging
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    import msvcrt
+    fcntl = None
+
+# chunks are cut when the low bits of the hash are zero, roughly every 8KB
+chunk_mask = 0x1fff
+min_chunk = 2 * 1024
+max_chunk = 64 * 1024
+
+# versions kept per file before the oldest are dropped
+default_keep = 100
+
+# pseudo random table for the gear hash, must never change once backups exist
+gear = [int.from_bytes(hashlib.sha1(bytes((i,))).digest()[:4], "big") for i in range(256)]
+
+def chunk_bounds(data):
+    """Return the end offset of every content defined chunk in data."""
+    bounds = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = min(start + max_chunk, size)
+        # the hash only depends on the last 32 bytes, so skip to the minimum
+        offset = start + min_chunk
+        h = 0
+        while offset < end:
+            h = ((h << 1) + gear[data[offset]]) & 0xffffffff
+            offset += 1
+            if h & chunk_mask == 0:
+                end = offset
+                break
+        bounds.append(end)
+        start = end
+    return bounds
+
+class StoreLock():
+    """
+    Context manager holding a lock file shared with other processes. Nested
+    use in one process only takes it once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self.lock_file = None
+
+    def __enter__(self):
+        if self.depth == 0:
+            lock_file = open(self.path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                try:
+                    # tries for 10 seconds, then raises OSError
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                except OSError:
+                    lock_file.close()
+                    raise
+            self.lock_file = lock_file
+        self.depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl is None:
+                self.lock_file.seek(0)
+                msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            # closing it releases a flock
+            self.lock_file.close()
+            self.lock_file = None
+        return False
+
+class BackupStore():
+    def __init__(self, folder):
+        self.folder = folder
+        self.chunk_folder = os.path.join(folder, "chunks")
+        self.history_folder = os.path.join(folder, "history")
+        for f in self.chunk_folder, self.history_folder:
+            if not os.path.isdir(f):
+                os.makedirs(f)
+        # stops another process collecting chunks a new version uses before
+        # its history is written
+        self.lock = StoreLock(os.path.join(folder, "lock"))
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunk_folder, digest[:2], digest)
+
+    def put_chunk(self, chunk):
+        """Store a chunk if it isn't already and return its digest."""
+        digest = hashlib.sha1(chunk).hexdigest()
+        path = self.chunk_path(digest)
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.mkdir(os.path.dirname(path))
+            # batch edits can be storing the same chunk from other processes
+            temp = "%s.%d.tmp" % (path, os.getpid())
+            chunk_file = open(temp, "wb")
+            chunk_file.write(zlib.compress(chunk))
+            chunk_file.close()
+            os.replace(temp, path)
+        return digest
+
+    def get_chunk(self, digest):
+        chunk_file = open(self.chunk_path(digest), "rb")
+        chunk = zlib.decompress(chunk_file.read())
+        chunk_file.close()
+        return chunk
+
+    def history_path(self, name):
+        return os.path.join(self.history_folder, name + ".json")
+
+    def history_name(self, filename):
+        """Name of the history of a file, told apart from others by its full path."""
+        path = os.path.normcase(os.path.abspath(filename))
+        return "%s-%s" % (os.path.basename(filename),
+                          hashlib.sha1(path.encode("utf-8")).hexdigest()[:8])
+
+    def file_histories(self, filename):
+        """
+        Return the names of a file's histories: its own, then the one named
+        by file name alone from before histories were named by path too, if
+        there is one. That one is only read, never added to, as it could
+        belong to a save with the same name in another folder.
+        """
+        names = [self.history_name(filename)]
+        old_name = os.path.basename(filename)
+        if os.path.isfile(self.history_path(old_name)):
+            names.append(old_name)
+        return names
+
+    def versions(self, name):
+        """Return the list of backed up versions of a file, oldest first."""
+        try:
+            return json.load(open(self.history_path(name)))
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            logging.exception("Backup history for %s is corrupt", name)
+            return []
+
+    def write_versions(self, name, versions):
+        path = self.history_path(name)
+        history_file = open(path + ".tmp", "w")
+        json.dump(versions, history_file, indent=1)
+        history_file.close()
+        os.replace(path + ".tmp", path)
+
+    def names(self):
+        """Return the names of every file with backups."""
+        return sorted(f[:-5] for f in os.listdir(self.history_folder) if f.endswith(".json"))
+
+    def backup(self, filename, keep=default_keep):
+        """
+        Add the current contents of filename to its history. Returns the new
+        version, or None if it's the same as the last one.
+        """
+        name = self.history_name(filename)
+        data = open(filename, "rb").read()
+        digest = hashlib.sha1(data).hexdigest()
+        # chunking is the slow part and doesn't need the lock
+        bounds = chunk_bounds(data)
+        with self.lock:
+            versions = self.versions(name)
+            if len(versions) > 0 and versions[-1]["sha1"] == digest:
+                return None
+
+            chunks = []
+            start = 0
+            view = memoryview(data)
+            for end in bounds:
+                chunks.append(self.put_chunk(view[start:end]))
+                start = end
+
+            version = {
+                "id": time.strftime("%Y%m%d-%H%M%S") + "-" + digest[:8],
+                "time": time.time(),
+                "size": len(data),
+                "sha1": digest,
+                "chunks": chunks
+            }
+            versions.append(version)
+            logging.info("Backed up %s as %s (%d chunks)", filename, version["id"], len(chunks))
+
+            if keep is not None and len(versions) > keep:
+                versions = versions[-keep:]
+                self.write_versions(name, versions)
+                self.collect_garbage()
+            else:
+                self.write_versions(name, versions)
+            return version
+
+    def find_version(self, name, version_id):
+        for version in self.versions(name):
+            if version["id"] == version_id or version["sha1"] == version_id:
+                return version
+        raise KeyError("No backup %s of %s" % (version_id, name))
+
+    def read(self, name, version_id):
+        """Return the contents of one version of a file."""
+        with self.lock:
+            version = self.find_version(name, version_id)
+            data = b"".join(self.get_chunk(x) for x in version["chunks"])
+        if hashlib.sha1(data).hexdigest() != version["sha1"]:
+            raise ValueError("Backup %s of %s is corrupt" % (version_id, name))
+        return data
+
+    def restore(self, filename, version_id):
+        """Overwrite filename with one of its backed up versions."""
+        data = None
+        for name in self.file_histories(filename):
+            try:
+                data = self.read(name, version_id)
+                break
+            except KeyError:
+                pass
+        if data is None:
+            raise KeyError("No backup %s of %s" % (version_id, filename))
+        temp = filename + ".tmp"
+        restore_file = open(temp, "wb")
+        restore_file.write(data)
+        restore_file.close()
+        os.replace(temp, filename)
+        logging.info("Restored %s from backup %s", filename, version_id)
+
+    def collect_garbage(self):
+        """Delete chunks no version refers to anymore."""
+        with self.lock:
+            used = set()
+            for name in self.names():
+                for version in self.versions(name):
+                    used.update(version["chunks"])
+
+            removed = 0
+            for prefix in os.listdir(self.chunk_folder):
+                folder = os.path.join(self.chunk_folder, prefix)
+                for digest in os.listdir(folder):
+                    if digest not in used and not digest.endswith(".tmp"):
+                        os.remove(os.path.join(folder, digest))
+                        removed += 1
+        logging.debug("Removed %d unused backup chunks", removed)
+        return removed
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    usage = __doc__[__doc__.index("$"):]
+    if len(sys.argv) < 3 or sys.argv[1] not in ("list", "restore"):
+        print(usage)
+        sys.exit(1)
+
+    store = BackupStore(sys.argv[2])
+    if sys.argv[1] == "list":
+        if len(sys.argv) > 3:
+            names = [x for x in store.file_histories(sys.argv[3])
+                     if os.path.isfile(store.history_path(x))]
+        else:
+            names = store.names()
+        for name in names:
+            print(name)
+            for version in store.versions(name):
+                print("    %s %10d bytes %4d chunks" % (version["id"], version["size"],
+                                                       len(version["chunks"])))
+    elif len(sys.argv) == 5:
+        try:
+            store.restore(sys.argv[3], sys.argv[4])
+        except (KeyError, ValueError, OSError) as err:
+            print(err)
+            sys.exit(1)
+    else:
+        print(usage)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
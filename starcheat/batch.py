@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+"""
+Batch save editing
+
+Applies a list of edits to every .player file matching a filter, spread over
+a process pool. Edits are a JSON list like this:
+
+[
+    {"op": "set", "path": "inventory.money", "value": 9999},
+    {"op": "add_item", "name": "beamaxe", "count": 1, "bag": "bag"},
+    {"op": "remove_item", "name": "dirtmaterial"},
+    {"op": "grant_blueprints", "names": ["copperarmorhead", "copperarmorchest"]},
+    {"op": "set_stat", "stat": "health", "value": 100, "max": 100}
+]
+
+Paths are dot separated keys into the player entity, list indexes are
+numbers. From the command line:
+
+$ python ./batch.py -e edits.json --race human --dry-run <player folder>
+
+Matching saves can also be dumped as JSON Lines (one {"file", "entity"}
+object per line) for other tools with --dump-jsonl.
+"""
+
+import os, sys, json, fnmatch, logging, traceback
+import concurrent.futures
+from optparse import OptionParser
+
+import saves, backups
+
+# bags add_item/remove_item look in when none is given
+item_bags = ("bag", "tileBag", "actionBar", "wieldable", "equipment")
+
+# set_stat name: (PlayerSave setter, does it take a current value)
+stats = {
+    "health": ("set_health", True),
+    "energy": ("set_energy", True),
+    "food": ("set_food", True),
+    "breath": ("set_breath", True),
+    "warmth": ("set_max_warmth", False),
+    "max_health": ("set_max_health", False),
+    "max_energy": ("set_max_energy", False),
+    "max_food": ("set_max_food", False),
+    "max_breath": ("set_max_breath", False),
+    "energy_regen": ("set_energy_regen", False),
+    "pixels": ("set_pixels", False),
+    "play_time": ("set_play_time", False)
+}
+
+class BatchError(Exception):
+    pass
+
+def split_path(path):
+    keys = []
+    for key in path.split("."):
+        try:
+            keys.append(int(key))
+        except ValueError:
+            keys.append(key)
+    return keys
+
+def set_path(entity, path, value):
+    keys = split_path(path)
+    target = entity
+    try:
+        for key in keys[:-1]:
+            target = target[key]
+        if isinstance(target, dict):
+            old = target.get(keys[-1])
+        else:
+            old = target[keys[-1]]
+        target[keys[-1]] = value
+    except (KeyError, IndexError, TypeError):
+        raise BatchError("Invalid path: %s" % path)
+    return "%s: %s -> %s" % (path, json.dumps(saves.unlazy(old)), json.dumps(value))
+
+def add_item(player, name, count=1, data={}, bag="bag"):
+    slots = player.entity["inventory"][bag]
+    for i in range(len(slots)):
+        if slots[i] is None:
+            slots[i] = saves.new_item(name, count, data)
+            return "added %d %s to %s slot %d" % (count, name, bag, i)
+    raise BatchError("No empty slot in %s for %s" % (bag, name))
+
+def remove_item(player, name, bag=None):
+    removed = 0
+    for bag_name in (bag,) if bag is not None else item_bags:
+        slots = player.entity["inventory"].get(bag_name, [])
+        for i in range(len(slots)):
+            if slots[i] is not None and slots[i]["name"] == name:
+                slots[i] = None
+                removed += 1
+    return "removed %d %s" % (removed, name)
+
+def grant_blueprints(player, names):
+    known = set(x["name"] for x in player.get_blueprints())
+    new = [x for x in names if x not in known]
+    if len(new) > 0:
+        player.set_blueprints(player.get_blueprints() + [saves.new_item(x, 1, {}) for x in new])
+    return "granted %d blueprints" % len(new)
+
+def set_stat(player, stat, value, max=None):
+    try:
+        setter, current = stats[stat]
+    except KeyError:
+        raise BatchError("Unknown stat: %s" % stat)
+    if current:
+        if max is None:
+            raise BatchError("Stat %s needs a max" % stat)
+        getattr(player, setter)(value, max)
+    else:
+        getattr(player, setter)(value)
+    return "%s = %s" % (stat, value)
+
+def apply_edit(player, edit):
+    """Apply one edit to a PlayerSave and return a description of it."""
+    args = dict(edit)
+    op = args.pop("op", None)
+    try:
+        if op == "set":
+            return set_path(player.entity, args["path"], args["value"])
+        elif op == "add_item":
+            return add_item(player, **args)
+        elif op == "remove_item":
+            return remove_item(player, **args)
+        elif op == "grant_blueprints":
+            return grant_blueprints(player, **args)
+        elif op == "set_stat":
+            return set_stat(player, **args)
+    except (KeyError, TypeError) as err:
+        raise BatchError("Bad %s edit %s: %s" % (op, json.dumps(edit), err))
+    raise BatchError("Unknown edit: %s" % json.dumps(edit))
+
+def load_edits(filename):
+    edits = json.load(open(filename))
+    if type(edits) is not list or not all(type(x) is dict for x in edits):
+        raise BatchError("Edits must be a list of objects")
+    return edits
+
+def matches(player, filters):
+    """Check a player against the name/race/uuid glob filters."""
+    values = {"name": player.get_name, "race": player.get_race, "uuid": player.get_uuid}
+    for key, pattern in filters.items():
+        if pattern is not None and not fnmatch.fnmatch(values[key]().lower(), pattern.lower()):
+            return False
+    return True
+
+def process(filename, edits, filters={}, dry_run=False, backup_folder=None):
+    """Apply edits to one save file and return a result dict for it."""
+    result = {"file": filename, "name": None, "status": "unchanged", "changes": [], "diff": []}
+    try:
+        original = open(filename, "rb").read()
+        player = saves.PlayerSave(filename, lazy=True)
+        result["name"] = player.get_name()
+        if not matches(player, filters):
+            result["status"] = "skipped"
+            return result
+
+        for edit in edits:
+            result["changes"].append(apply_edit(player, edit))
+
+        # untouched values are copied out as is, so this is exact
+        data = player.export_save()
+        if data != original:
+            result["status"] = "changed"
+            result["diff"] = saves.format_changes(player.diff())
+            if not dry_run:
+                if backup_folder is not None:
+                    backups.BackupStore(backup_folder).backup(filename)
+                temp = filename + ".tmp"
+                save_file = open(temp, "wb")
+                save_file.write(data)
+                save_file.close()
+                os.replace(temp, filename)
+    except (saves.WrongSaveVer, BatchError, OSError) as err:
+        result["status"] = "error"
+        result["error"] = str(err)
+    except Exception:
+        result["status"] = "error"
+        result["error"] = traceback.format_exc()
+    return result
+
+def find_saves(paths, pattern="*.player"):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for f in sorted(os.listdir(path)):
+                if fnmatch.fnmatch(f, pattern):
+                    found.append(os.path.join(path, f))
+        else:
+            found.append(path)
+    return found
+
+def run(filenames, edits, filters={}, dry_run=False, jobs=None, backup_folder=None):
+    """Process every file over a process pool, yielding results as they finish."""
+    if jobs == 1 or len(filenames) <= 1:
+        for filename in filenames:
+            yield process(filename, edits, filters, dry_run, backup_folder)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process, f, edits, filters, dry_run, backup_folder)
+                   for f in filenames]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+def main():
+    parser = OptionParser(usage="%prog -e EDITS [options] <.player files or folders>",
+                          description="applies a list of edits to many starbound saves")
+    parser.add_option("-e", "--edits", dest="edits",
+                      help="JSON file with the list of edits to apply")
+    parser.add_option("-n", "--name", dest="name", help="only edit characters whose name matches this glob")
+    parser.add_option("-r", "--race", dest="race", help="only edit characters of this race")
+    parser.add_option("-u", "--uuid", dest="uuid", help="only edit the character with this uuid")
+    parser.add_option("-p", "--pattern", dest="pattern", default="*.player",
+                      help="file name glob used in folders (default to *.player)")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                      help="number of worker processes (default to one per CPU)")
+    parser.add_option("-b", "--backup-folder", dest="backup_folder",
+                      help="back up each save to this backup store before writing it")
+    parser.add_option("-d", "--dry-run", dest="dry_run", action="store_true",
+                      help="report what would change without writing anything")
+    parser.add_option("--dump-jsonl", dest="dump_jsonl",
+                      help="write the matching saves, as they are after the run, to this JSON Lines file")
+    parser.add_option("--json", dest="json", action="store_true",
+                      help="print results as JSON")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="list every change made to each file")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if (options.edits is None and options.dump_jsonl is None) or len(args) == 0:
+        parser.error("need an edits file (or --dump-jsonl) and at least one save")
+
+    edits = []
+    if options.edits is not None:
+        try:
+            edits = load_edits(options.edits)
+        except (OSError, ValueError, BatchError) as err:
+            parser.error("could not load edits: %s" % err)
+
+    filters = {"name": options.name, "race": options.race, "uuid": options.uuid}
+    filenames = find_saves(args, options.pattern)
+    results = []
+    for result in run(filenames, edits, filters, options.dry_run, options.jobs,
+                      options.backup_folder):
+        results.append(result)
+        if options.json:
+            continue
+        print("%-10s %s (%s)" % (result["status"], result["file"], result["name"]))
+        if "error" in result:
+            print("    " + result["error"].strip().replace("\n", "\n    "))
+        elif options.verbose and result["status"] != "skipped":
+            for change in result["changes"]:
+                print("    " + change)
+            for line in result["diff"]:
+                print("      " + line)
+
+    if options.json:
+        json.dump(sorted(results, key=lambda x: x["file"]), sys.stdout,
+                  sort_keys=True, indent=4, separators=(',', ': '))
+        print()
+    else:
+        totals = {}
+        for result in results:
+            totals[result["status"]] = totals.get(result["status"], 0) + 1
+        print(", ".join("%d %s" % (totals[x], x) for x in sorted(totals)) +
+              (" (dry run)" if options.dry_run else ""))
+
+    if options.dump_jsonl is not None:
+        dumped = sorted(x["file"] for x in results if x["status"] in ("changed", "unchanged"))
+        dump_file = open(options.dump_jsonl, "w")
+        saves.dump_json_lines(dumped, dump_file)
+        dump_file.close()
+
+    if any(x["status"] == "error" for x in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
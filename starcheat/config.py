@@ -17,7 +17,7 @@ if os.path.isdir(config_folder) == False:
     os.mkdir(config_folder)
 
 STARCHEAT_VERSION = "0.14 (Enraged Koala)"
-CONFIG_VERSION = 8
+CONFIG_VERSION = 11
 ini_file = os.path.join(config_folder, "starcheat.ini")
 
 class Config():
@@ -48,7 +48,7 @@ class Config():
         assets_folder = os.path.join(starbound_folder, "assets")
         player_folder = os.path.join(starbound_folder, "player")
         backup_folder = os.path.join(config_folder, "backups")
-        make_backups = "no"
+        make_backups = "yes"
         update_timestamps = "no"
         assets_db = os.path.join(config_folder, "assets.db")
 
@@ -57,6 +57,7 @@ class Config():
             "assets_folder": assets_folder,
             "player_folder": player_folder,
             "backup_folder": backup_folder,
+            "make_backups": make_backups,
             "assets_db": assets_db,
             "update_timestamps": update_timestamps,
             "config_version": CONFIG_VERSION
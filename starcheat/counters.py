@@ -0,0 +1,94 @@
+"""
+Runtime performance counters
+
+Unlike tracing these are always on, they're just integer increments. Code
+that does something expensive bumps a named counter:
+
+counters.incr("json.parse")
+
+and anything interested can read them back with snapshot(), or see how much
+one operation cost with the @measured decorator or measure() context.
+"""
+
+import time, collections
+
+# counter name: int
+counts = collections.Counter()
+# timer name: total seconds
+timings = collections.Counter()
+# last measured delta for each @measured operation
+operations = {}
+
+# queries slower than this many seconds end up in the slow query log
+slow_query_time = 0.05
+slow_queries = collections.deque(maxlen=50)
+
+def incr(name, amount=1):
+    counts[name] += amount
+
+def add_time(name, seconds):
+    timings[name] += seconds
+
+def cache_hit(cache):
+    counts["cache.%s.hit" % cache] += 1
+
+def cache_miss(cache):
+    counts["cache.%s.miss" % cache] += 1
+
+def query(sql, seconds):
+    """Record one sqlite query and log it if it was slow."""
+    counts["sqlite.query"] += 1
+    timings["sqlite.query"] += seconds
+    if seconds >= slow_query_time:
+        slow_queries.append((time.strftime("%H:%M:%S"), seconds, " ".join(sql.split())))
+
+def snapshot():
+    """Return a copy of every counter and timer."""
+    return {"counts": dict(counts), "timings": dict(timings)}
+
+def delta(before, after):
+    """Return the counters that changed between two snapshots."""
+    result = {"counts": {}, "timings": {}}
+    for kind in result:
+        for name, value in after[kind].items():
+            change = value - before[kind].get(name, 0)
+            if change:
+                result[kind][name] = change
+    return result
+
+def reset():
+    counts.clear()
+    timings.clear()
+    operations.clear()
+    slow_queries.clear()
+
+class Measure():
+    """Context manager that collects the counter delta of its block."""
+    def __init__(self, name=None):
+        self.name = name
+        self.result = None
+
+    def __enter__(self):
+        self.before = snapshot()
+        return self
+
+    def __exit__(self, *args):
+        self.result = delta(self.before, snapshot())
+        if self.name is not None:
+            operations[self.name] = self.result
+        return False
+
+def measure(name=None):
+    return Measure(name)
+
+def measured(func):
+    """Decorator that keeps the counter delta of the last call of func."""
+    name = func.__qualname__
+    def wrapper(*args, **kwargs):
+        with Measure(name):
+            return func(*args, **kwargs)
+    wrapper.__name__ = func.__name__
+    wrapper.__qualname__ = name
+    wrapper.__doc__ = func.__doc__
+    wrapper.__wrapped__ = func
+    return wrapper
@@ -2,16 +2,59 @@
 Qt appearance management dialog
 """
 
+import logging, queue
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QDialog, QColorDialog, QTableWidgetItem
 from PyQt5.QtGui import QColor, QBrush, QPixmap, QImage, QIcon
-from PIL.ImageQt import ImageQt
 
-import assets, qt_appearance, qt_coloredit
-from gui.common import preview_icon
+import saves, assets, qt_appearance, qt_coloredit, tracing
+from gui.common import preview_icon, image_pixmap
 from config import Config
 
+# how long the options have to stop changing before the player is updated
+write_delay = 150
+
+class PreviewRenderer(QtCore.QThread):
+    """
+    Renders player previews off the GUI thread with its own asset connection.
+    Only the newest request is rendered, anything older is skipped.
+    """
+    rendered = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent):
+        QtCore.QThread.__init__(self, parent)
+        self.requests = queue.Queue()
+
+    def request(self, appearance):
+        """Queue a render_appearance of (species, gender, hair, body directives, hair directives)."""
+        self.requests.put(appearance)
+
+    def stop(self):
+        self.requests.put(None)
+        self.wait()
+
+    def run(self):
+        db = assets.Assets(Config().read("assets_db"), Config().read("starbound_folder"))
+        species = db.species()
+        while True:
+            appearance = self.requests.get()
+            try:
+                while appearance is not None:
+                    appearance = self.requests.get_nowait()
+            except queue.Empty:
+                pass
+            if appearance is None:
+                return
+
+            try:
+                image = species.render_appearance(*appearance)
+            except (OSError, TypeError, AttributeError):
+                logging.exception("Couldn't load species images")
+                image = None
+            self.rendered.emit(image)
+
 class Appearance():
+    @tracing.traced
     def __init__(self, main_window):
         self.dialog = QDialog(main_window.window)
         self.ui = qt_appearance.Ui_Dialog()
@@ -69,8 +112,8 @@ class Appearance():
             type_widget.setCurrentText(current_appearance[value][1])
             if len(type_data) < 2: type_widget.setEnabled(False)
 
-            group_widget.currentTextChanged.connect(self.write_appearance_values)
-            type_widget.currentTextChanged.connect(self.write_appearance_values)
+            group_widget.currentTextChanged.connect(self.queue_write)
+            type_widget.currentTextChanged.connect(self.queue_write)
 
         # personality
         for option in self.species.get_personality():
@@ -83,12 +126,38 @@ class Appearance():
             if len(self.colors[value]) == 0:
                 getattr(self.ui, value+"_color").setEnabled(False)
 
+        # rapid changes (scrolling through a combobox) are written as one
+        self.write_timer = QtCore.QTimer(self.dialog)
+        self.write_timer.setSingleShot(True)
+        self.write_timer.setInterval(write_delay)
+        self.write_timer.timeout.connect(self.write_appearance_values)
+
         # player image
-        image = self.assets.species().render_player(self.player)
-        pixmap = QPixmap.fromImage(ImageQt(image)).scaled(86, 86)
+        self.renderer = PreviewRenderer(self.dialog)
+        self.renderer.rendered.connect(self.show_preview)
+        self.renderer.start()
+        self.dialog.finished.connect(lambda result: self.renderer.stop())
+        self.render_preview()
+
+    def queue_write(self, *args):
+        self.write_timer.start()
+
+    def render_preview(self):
+        if self.renderer.isRunning():
+            self.renderer.request((self.player.get_race(), self.player.get_gender(),
+                                   tuple(self.player.get_hair()),
+                                   saves.pack_color_directives(self.colors["body"]),
+                                   saves.pack_color_directives(self.colors["hair"])))
+
+    def show_preview(self, image):
+        if image is None:
+            pixmap = QPixmap()
+        else:
+            pixmap = image_pixmap(image).scaled(86, 86)
         self.ui.player_preview.setPixmap(pixmap)
 
     def write_appearance_values(self):
+        self.write_timer.stop()
         hair = self.ui.hair_group.currentText(), self.ui.hair_type.currentText()
         facial_hair = self.ui.facial_hair_group.currentText(), self.ui.facial_hair_type.currentText()
         facial_mask = self.ui.facial_mask_group.currentText(), self.ui.facial_mask_type.currentText()
@@ -102,15 +171,7 @@ class Appearance():
         self.player.set_facial_hair_directives(self.colors["facial_hair"])
         self.player.set_facial_mask_directives(self.colors["facial_mask"])
 
-        # render player preview
-        try:
-            image = self.assets.species().render_player(self.player)
-            pixmap = QPixmap.fromImage(ImageQt(image)).scaled(86, 86)
-        except (OSError, TypeError, AttributeError):
-            logging.exception("Couldn't load species images")
-            pixmap = QPixmap()
-
-        self.ui.player_preview.setPixmap(pixmap)
+        self.render_preview()
 
         self.main_window.window.setWindowModified(True)
 
@@ -122,17 +183,21 @@ class Appearance():
 
     def hair_icon(self, species, hair_type, hair_group):
         image_data = self.assets.species().get_hair_image(species, hair_type, hair_group)
-        return QPixmap.fromImage(ImageQt(image_data))
+        return image_pixmap(image_data)
 
     # for color button signals
     def new_body_color_edit(self):
         self.colors["body"] = self.new_color_edit("body")
+        self.queue_write()
     def new_hair_color_edit(self):
         self.colors["hair"] = self.new_color_edit("hair")
+        self.queue_write()
     def new_facial_hair_color_edit(self):
         self.colors["facial_hair"] = self.new_color_edit("facial_hair")
+        self.queue_write()
     def new_facial_mask_color_edit(self):
         self.colors["facial_mask"] = self.new_color_edit("facial_mask")
+        self.queue_write()
 
 class ColorItem(QTableWidgetItem):
     def __init__(self, color):
@@ -142,6 +207,7 @@ class ColorItem(QTableWidgetItem):
         self.setBackground(QBrush(QColor("#"+color)))
 
 class ColorEdit():
+    @tracing.traced
     def __init__(self, parent, directives):
         self.dialog = QDialog(parent)
         self.ui = qt_coloredit.Ui_Dialog()
@@ -2,13 +2,18 @@
 Qt blueprint/recipe management dialog
 """
 
-from PyQt5.QtWidgets import QDialog, QListWidgetItem
+import bisect, collections
+from PyQt5.QtWidgets import QDialog
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
 
-import assets, qt_blueprints
+import assets, qt_blueprints, tracing
 from config import Config
 
 # TODO: rework whole dialog with pretty icons and stuff like that
 
+# adding or removing more rows than this at once resets the model instead
+bulk_rows = 50
+
 def new_blueprint(name, data):
     bp = {
         "name": name,
@@ -17,12 +22,56 @@ def new_blueprint(name, data):
     }
     return bp
 
-class BlueprintItem(QListWidgetItem):
-    def __init__(self, blueprint):
-        QListWidgetItem.__init__(self, blueprint["name"])
-        self.blueprint = blueprint
+class NameListModel(QAbstractListModel):
+    """Sorted list of blueprint names for a list view."""
+    def __init__(self, names=()):
+        QAbstractListModel.__init__(self)
+        self.names = sorted(names)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.names[index.row()]
+        return None
+
+    def set_names(self, names):
+        self.beginResetModel()
+        self.names = sorted(names)
+        self.endResetModel()
+
+    def add(self, names):
+        """Insert names in their sorted places."""
+        if len(names) > bulk_rows:
+            self.set_names(self.names + list(names))
+            return
+        for name in names:
+            row = bisect.bisect_left(self.names, name)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.names.insert(row, name)
+            self.endInsertRows()
+
+    def remove(self, names):
+        if len(names) > bulk_rows:
+            names = set(names)
+            self.set_names([x for x in self.names if x not in names])
+            return
+        for name in names:
+            row = bisect.bisect_left(self.names, name)
+            if row < len(self.names) and self.names[row] == name:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.names[row]
+                self.endRemoveRows()
+
+def selected_names(view):
+    model = view.model()
+    return [model.names[x.row()] for x in view.selectionModel().selectedRows()]
 
 class BlueprintLib():
+    @tracing.traced
     def __init__(self, parent, known_blueprints):
         """Blueprint library management dialog."""
         # BUG: some of the tier weapons are not importing correctly and showing
@@ -37,18 +86,18 @@ class BlueprintLib():
         self.assets = assets.Assets(assets_db_file, starbound_folder)
 
         self.blueprints = self.assets.blueprints()
-        self.known_blueprints = known_blueprints
+        # name: blueprint, in the order the save had them
+        self.known_blueprints = collections.OrderedDict()
+        for blueprint in known_blueprints:
+            self.known_blueprints[blueprint["name"]] = blueprint
 
         # populate known list
-        self.ui.known_blueprints.clear()
-        for blueprint in self.known_blueprints:
-            self.ui.known_blueprints.addItem(BlueprintItem(blueprint))
-        self.ui.known_blueprints.sortItems(0)
+        self.known_model = NameListModel(self.known_blueprints.keys())
+        self.ui.known_blueprints.setModel(self.known_model)
 
         # populate initial available list
-        self.ui.available_blueprints.clear()
-        for blueprint in self.blueprints.get_all_blueprints():
-            self.ui.available_blueprints.addItem(blueprint[4])
+        self.available_model = NameListModel(x.name for x in self.blueprints.get_all_blueprints())
+        self.ui.available_blueprints.setModel(self.available_model)
 
         # populate category combobox
         for cat in self.blueprints.get_categories():
@@ -56,6 +105,7 @@ class BlueprintLib():
 
         self.ui.add_button.clicked.connect(self.add_blueprint)
         self.ui.remove_button.clicked.connect(self.remove_blueprint)
+        self.ui.learn_all_button.clicked.connect(self.add_all_blueprints)
 
         self.ui.filter.textChanged.connect(self.update_available_list)
         self.ui.category.currentTextChanged.connect(self.update_available_list)
@@ -67,47 +117,36 @@ class BlueprintLib():
         category = self.ui.category.currentText()
         name = self.ui.filter.text()
         result = self.blueprints.filter_blueprints(category, name)
-        self.ui.available_blueprints.clear()
-        for blueprint in result:
-            self.ui.available_blueprints.addItem(blueprint[4])
-        self.ui.available_blueprints.setCurrentRow(0)
-
-    def add_blueprint(self):
-        """Add currently select blueprint in available list to known list."""
-        try:
-            selected = self.ui.available_blueprints.selectedItems()
-        except AttributeError:
-            # nothing selected
-            return
+        self.available_model.set_names(x.name for x in result)
+        self.ui.available_blueprints.setCurrentIndex(self.available_model.index(0))
 
-        known = [x["name"] for x in self.known_blueprints]
-        for blueprint in selected:
+    def learn(self, names):
+        """Add every blueprint in names that isn't already known."""
+        new = []
+        for name in names:
             # don't add more than one of each blueprint
-            if blueprint.text() in known:
+            if name in self.known_blueprints:
                 continue
             # TODO: we don't support data from asset blueprints yet'
-            self.known_blueprints.append(new_blueprint(blueprint.text(), {}))
+            self.known_blueprints[name] = new_blueprint(name, {})
+            new.append(name)
+        self.known_model.add(new)
+        return new
+
+    def add_blueprint(self):
+        """Add currently select blueprint in available list to known list."""
+        self.learn(selected_names(self.ui.available_blueprints))
 
-        # regenerate the list
-        self.ui.known_blueprints.clear()
-        for blueprint in self.known_blueprints:
-            self.ui.known_blueprints.addItem(BlueprintItem(blueprint))
-        self.ui.known_blueprints.sortItems(0)
-        self.ui.known_blueprints.setCurrentRow(0)
+    def add_all_blueprints(self):
+        """Learn every blueprint in the available list, i.e. the current category and filter."""
+        self.learn(self.available_model.names)
 
     def remove_blueprint(self):
         """Remove currently selected blueprint in known list."""
-        try:
-            selected = self.ui.known_blueprints.selectedItems()
-        except AttributeError:
-            return
-
-        for item in selected:
-            self.known_blueprints.remove(item.blueprint)
-
-        self.ui.known_blueprints.clear()
-        for blueprint in self.known_blueprints:
-            self.ui.known_blueprints.addItem(BlueprintItem(blueprint))
+        selected = selected_names(self.ui.known_blueprints)
+        for name in selected:
+            del self.known_blueprints[name]
+        self.known_model.remove(selected)
 
     def get_known_list(self):
-        return self.known_blueprints
+        return list(self.known_blueprints.values())
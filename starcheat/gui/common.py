@@ -7,29 +7,46 @@ from PyQt5.QtWidgets import QTableWidgetItem
 from PyQt5.QtGui import QPixmap, QImage
 from sqlite3 import OperationalError
 
-from PIL.ImageQt import ImageQt
-
-import assets
+import assets, counters
 from config import Config
 
-def inv_icon(item_name):
-    """Return a QPixmap object of the inventory icon of a given item (if possible)."""
-    assets_db_file = Config().read("assets_db")
-    starbound_folder = Config().read("starbound_folder")
-    db = assets.Assets(assets_db_file, starbound_folder)
-    icon_file = db.items().get_item_icon(item_name)
+def image_pixmap(image):
+    """Return a QPixmap of a PIL image."""
+    # PIL's Qt glue is slow to import, leave it until the first image
+    from PIL.ImageQt import ImageQt
+    counters.incr("pixmap.convert")
+    return QPixmap.fromImage(ImageQt(image))
+
+def data_pixmap(data):
+    """Return a QPixmap from raw image file data."""
+    counters.incr("pixmap.convert")
+    return QPixmap.fromImage(QImage.fromData(data))
+
+def inv_icon(item_name, db=None, meta=None):
+    """Return a QPixmap object of the inventory icon of a given item (if possible).
+
+    Pass an open Assets instance and the item's indexed metadata row if you
+    already have them, to skip another connection and lookup.
+    """
+    if db is None:
+        assets_db_file = Config().read("assets_db")
+        starbound_folder = Config().read("starbound_folder")
+        db = assets.Assets(assets_db_file, starbound_folder)
+    if meta is None:
+        meta = db.items().get_item_meta(item_name)
+    icon_file = db.items().get_item_icon(item_name, meta)
 
     if icon_file == None:
         try:
-            image_file = db.items().get_item_image(item_name)
-            return QPixmap.fromImage(ImageQt(image_file)).scaledToHeight(64)
+            image_file = db.items().get_item_image(item_name, meta)
+            return image_pixmap(image_file).scaledToHeight(64)
         except (TypeError, AttributeError):
-            return QPixmap.fromImage(QImage.fromData(db.items().missing_icon())).scaled(32, 32)
+            return data_pixmap(db.items().missing_icon()).scaled(32, 32)
 
     try:
-        return QPixmap.fromImage(ImageQt(icon_file)).scaled(32, 32)
+        return image_pixmap(icon_file).scaled(32, 32)
     except AttributeError:
-        return QPixmap.fromImage(QImage.fromData(db.items().missing_icon())).scaled(32, 32)
+        return data_pixmap(db.items().missing_icon()).scaled(32, 32)
 
 def preview_icon(race, gender):
     """Return an icon image for player race/gender previews."""
@@ -38,9 +55,9 @@ def preview_icon(race, gender):
     db = assets.Assets(assets_db_file, starbound_folder)
     icon_file = db.species().get_preview_image(race, gender)
     if icon_file is None:
-        return QPixmap.fromImage(QImage.fromData(db.missing_icon())).scaledToHeight(48)
+        return data_pixmap(db.missing_icon()).scaledToHeight(48)
     else:
-        return QPixmap.fromImage(QImage.fromData(icon_file)).scaledToHeight(48)
+        return data_pixmap(icon_file).scaledToHeight(48)
 
 def empty_slot():
     """Return an empty bag slot widget."""
@@ -65,20 +82,18 @@ class ItemWidget(QTableWidgetItem):
         QTableWidgetItem.__init__(self, self.item["name"])
         self.setTextAlignment(QtCore.Qt.AlignCenter)
 
+        # everything needed to draw the slot comes from one indexed row
+        meta = assets.items().get_item_meta(self.item["name"])
+
         name = self.item["name"]
         if "shortdescription" in self.item["data"]:
             name = self.item["data"]["shortdescription"]
-        else:
-            try:
-                asset_name = assets.items().get_item(name)[3]
-                if asset_name != "":
-                    name = asset_name
-            except TypeError:
-                pass
+        elif meta is not None and meta[3] != "":
+            name = meta[3]
 
         self.setToolTip(name + " (" + str(self.item["count"]) + ")")
 
-        icon = inv_icon(self.item["name"])
+        icon = inv_icon(self.item["name"], assets, meta)
         try:
             self.setIcon(QtGui.QIcon(icon))
         except TypeError:
@@ -2,14 +2,19 @@
 Qt item browser dialog
 """
 
-import logging
+import logging, threading, queue, collections
 from PyQt5.QtWidgets import QDialog, QTableWidgetItem, QDialogButtonBox, QListWidgetItem
 from PyQt5.QtGui import QPixmap, QImage
-from PIL.ImageQt import ImageQt
 
-import assets, qt_itembrowser
+import assets, qt_itembrowser, tracing, counters
+from gui.common import image_pixmap, data_pixmap
 from config import Config
 
+# most item details kept per browser, for items not shown right now
+detail_cache_size = 256
+# items either side of the selection read ahead in the background
+prefetch_distance = 5
+
 def format_status_effects(data):
     info = "<b>Status Effects:</b><br>"
     for status in data:
@@ -62,6 +67,108 @@ def generate_item_info(item_data):
 
     return info
 
+class ItemDetails():
+    """Everything the detail pane shows for one item."""
+    __slots__ = ("name", "info", "lines", "image", "is_icon", "pixmap")
+
+    def __init__(self, name, info, lines, image, is_icon):
+        self.name = name
+        self.info = info
+        self.lines = lines
+        # PIL image, or None for the missing icon
+        self.image = image
+        self.is_icon = is_icon
+        # made on the GUI thread the first time it's shown
+        self.pixmap = None
+
+def item_details(items, name):
+    """
+    Read and format the details of an item from an Items instance, or None if
+    it can't be loaded. Doesn't touch Qt, so it's safe off the GUI thread.
+    """
+    try:
+        item = items.get_item(name)
+    except TypeError:
+        logging.warning("Unable to load asset "+name)
+        return None
+
+    meta = items.get_item_meta(name)
+    image = items.get_item_image(name, meta)
+    is_icon = image is None
+    if is_icon:
+        image = items.get_item_icon(name, meta)
+
+    lines = []
+    for key in sorted(item[0].keys()):
+        try:
+            lines.append(str(key) + ": " + str(item[0][key]))
+        except TypeError:
+            pass
+
+    return ItemDetails(name, generate_item_info(item[0]), lines, image, is_icon)
+
+class DetailCache():
+    """
+    Bounded cache of ItemDetails. Misses are read on the GUI thread, while a
+    background thread with its own Assets connection (sqlite connections
+    can't be shared between threads) reads ahead whatever it's asked to.
+    """
+    def __init__(self, items, assets_db_file, starbound_folder, size=detail_cache_size):
+        self.items = items
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.prefetch_loop,
+                                       args=(assets_db_file, starbound_folder))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def get(self, name):
+        with self.lock:
+            if name in self.cache:
+                self.cache.move_to_end(name)
+                counters.cache_hit("item_details")
+                return self.cache[name]
+        counters.cache_miss("item_details")
+        details = item_details(self.items, name)
+        self.put(name, details)
+        return details
+
+    def put(self, name, details):
+        with self.lock:
+            self.cache[name] = details
+            self.cache.move_to_end(name)
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+    def prefetch(self, names):
+        """Read names ahead, in order, dropping anything still queued from before."""
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        for name in names:
+            self.queue.put(name)
+
+    def prefetch_loop(self, assets_db_file, starbound_folder):
+        items = assets.Assets(assets_db_file, starbound_folder).items()
+        while True:
+            name = self.queue.get()
+            if name is None:
+                return
+            with self.lock:
+                cached = name in self.cache
+            if not cached:
+                try:
+                    self.put(name, item_details(items, name))
+                except Exception:
+                    logging.exception("Unable to prefetch item %s", name)
+
+    def stop(self):
+        self.prefetch([])
+        self.queue.put(None)
 
 class BrowserItem(QListWidgetItem):
     def __init__(self, name, desc):
@@ -74,6 +181,7 @@ class BrowserItem(QListWidgetItem):
         self.name = name
 
 class ItemBrowser():
+    @tracing.traced
     def __init__(self, parent, just_browse=False, category="<all>"):
         """Dialog for viewing/searching indexed items and returning selection."""
         self.dialog = QDialog(parent)
@@ -91,6 +199,8 @@ class ItemBrowser():
 
         self.item_browse_select = None
         self.items = self.assets.items()
+        self.details = DetailCache(self.items, assets_db_file, starbound_folder)
+        self.dialog.finished.connect(lambda result: self.details.stop())
 
         # populate category combobox
         for cat in self.items.get_categories():
@@ -118,46 +228,47 @@ class ItemBrowser():
         except IndexError:
             return
 
-        try:
-            item = self.items.get_item(selected)
-        except TypeError:
-            logging.warning("Unable to load asset "+selected)
+        details = self.details.get(selected)
+        self.prefetch_neighbours()
+        if details is None:
             return
 
-        image_file = self.items.get_item_image(selected)
-        if image_file == None:
-            inv_icon_file = self.items.get_item_icon(selected)
-            if inv_icon_file != None:
-                icon = QPixmap.fromImage(ImageQt(inv_icon_file)).scaled(32, 32)
+        if details.pixmap is None:
+            if details.image is None:
+                details.pixmap = data_pixmap(self.items.missing_icon()).scaled(32, 32)
+            elif details.is_icon:
+                details.pixmap = image_pixmap(details.image).scaled(32, 32)
             else:
-                icon = QPixmap.fromImage(QImage.fromData(self.items.missing_icon())).scaled(32, 32)
-        else:
-            icon = QPixmap.fromImage(ImageQt(image_file)).scaledToHeight(64)
+                details.pixmap = image_pixmap(details.image).scaledToHeight(64)
 
         # last ditch
         try:
-            self.ui.item_icon.setPixmap(icon)
+            self.ui.item_icon.setPixmap(details.pixmap)
         except TypeError:
             logging.warning("Unable to load item image: "+selected)
             self.ui.item_icon.setPixmap(QPixmap())
 
-        self.ui.short_desc.setText(generate_item_info(item[0]))
+        self.ui.short_desc.setText(details.info)
 
         # populate default variant table
-        row = 0
-        self.ui.info.setRowCount(len(item[0]))
-        for key in sorted(item[0].keys()):
-            try:
-                text = str(key) + ": " + str(item[0][key])
-                table_item = QTableWidgetItem(text)
-                table_item.setToolTip(text)
-                self.ui.info.setItem(row, 0, table_item)
-            except TypeError:
-                pass
-            row += 1
+        self.ui.info.setRowCount(len(details.lines))
+        for row in range(len(details.lines)):
+            table_item = QTableWidgetItem(details.lines[row])
+            table_item.setToolTip(details.lines[row])
+            self.ui.info.setItem(row, 0, table_item)
 
         self.item_browse_select = selected
 
+    def prefetch_neighbours(self):
+        """Read ahead the items around the selection, nearest first."""
+        row = self.ui.items.currentRow()
+        names = []
+        for distance in range(1, prefetch_distance + 1):
+            for i in row + distance, row - distance:
+                if 0 <= i < self.ui.items.count():
+                    names.append(self.ui.items.item(i).name)
+        self.details.prefetch(names)
+
     def update_item_list(self):
         """Populate item list based on current filter details."""
         category = self.ui.category.currentText()
@@ -169,7 +280,7 @@ class ItemBrowser():
         #       but not when the edit box is changed (split this function)
         self.ui.items.clear()
         for item in result:
-            self.ui.items.addItem(BrowserItem(item[4], item[5]))
+            self.ui.items.addItem(BrowserItem(item.name, item.desc))
         self.ui.items.setCurrentRow(0)
 
     def get_selection(self):
@@ -13,12 +13,13 @@ from PyQt5.QtWidgets import QDialog, QTableWidgetItem, QDialogButtonBox, QFileDi
 from PyQt5.QtGui import QPixmap
 import json, copy, logging
 
-import assets, qt_itemedit, qt_itemeditoptions, saves
+import assets, qt_itemedit, qt_itemeditoptions, saves, tracing
 from gui.common import inv_icon, ItemWidget, empty_slot
 from gui.itembrowser import ItemBrowser, generate_item_info
 from config import Config
 
 class ItemEditOptions():
+    @tracing.traced
     def __init__(self, parent, key, value):
         self.dialog = QDialog(parent)
         self.ui = qt_itemeditoptions.Ui_Dialog()
@@ -67,6 +68,7 @@ class ItemOptionWidget(QTableWidgetItem):
         self.setToolTip(str(value))
 
 class ItemEdit():
+    @tracing.traced
     def __init__(self, parent, item, player, browser_category="<all>"):
         """Takes an item widget and displays an edit dialog for it."""
         self.dialog = QDialog(parent)
@@ -126,7 +128,7 @@ class ItemEdit():
         self.ui.desc.setText(item_info)
 
         try:
-            self.ui.icon.setPixmap(inv_icon(name))
+            self.ui.icon.setPixmap(inv_icon(name, self.assets))
         except TypeError:
             # TODO: change this to the x.png?
             self.ui.icon.setPixmap(QPixmap())
@@ -238,8 +240,11 @@ class ItemEdit():
         self.ui.item_type.setText(name)
 
     def max_count(self):
+        meta = self.assets.items().get_item_meta(self.ui.item_type.text())
         if "maxStack" in self.item["data"]:
             max = int(self.item["data"]["maxStack"])
+        elif meta is not None and meta[7] is not None:
+            max = meta[7]
         else:
             max = 999
         self.ui.count.setValue(max)
@@ -2,23 +2,42 @@
 Main application window for starcheat GUI
 """
 
-import sys, logging, json
+import os, sys, logging
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTableWidgetItem
-from PyQt5.QtWidgets import QFileDialog, QMessageBox
+from PyQt5.QtWidgets import QFileDialog, QMessageBox, QInputDialog
 from PyQt5.QtGui import QPixmap, QImage
-from PIL.ImageQt import ImageQt
+from PyQt5.QtCore import QTimer
 
-import saves, assets, qt_mainwindow
+import saves, assets, watcher, qt_mainwindow, tracing, counters
 from config import Config
-from gui.common import ItemWidget, empty_slot, preview_icon
+from gui.common import ItemWidget, empty_slot, preview_icon, image_pixmap
 from gui.utils import CharacterSelectDialog, OptionsDialog, AboutDialog, ModsDialog
+from gui.utils import DiagnosticsDialog
 from gui.utils import save_modified_dialog, new_setup_dialog
-from gui.itemedit import ItemEdit
-from gui.blueprints import BlueprintLib
-from gui.itembrowser import ItemBrowser
-from gui.appearance import Appearance
-from gui.techs import Techs
+
+# dialogs and tools behind menus and buttons are imported where they're used,
+# to keep them out of startup
+
+def describe_paths(paths):
+    """Short description of the values an undo step changed."""
+    names = []
+    for path in paths:
+        name = str(path[-2] if type(path[-1]) is int else path[-1])
+        if name not in names:
+            names.append(name)
+    return ", ".join(names[:3]) + ("..." if len(names) > 3 else "")
+
+# top level entity keys and the main window sections showing them
+entity_sections = {
+    "uuid": "update_identity",
+    "identity": "update_identity",
+    "description": "update_description",
+    "modeType": "update_game_mode",
+    "status": "update_stats",
+    "statusParameters": "update_stats",
+    "inventory": "update_inventory"
+}
 
 class StarcheatMainWindow(QMainWindow):
     """Overrides closeEvent on the main window to allow "want to save changes?" dialog"""
@@ -65,6 +84,8 @@ class MainWindow():
         self.items = self.assets.items()
 
         self.item_browser = None
+        # loaded the first time it's needed
+        self.validator = None
         # remember the last selected item browser category
         self.remember_browser = "<all>"
         self.options_dialog = None
@@ -81,10 +102,15 @@ class MainWindow():
         self.ui.actionExportJSON.triggered.connect(self.export_json)
         self.ui.actionImportJSON.triggered.connect(self.import_json)
         self.ui.actionMods.triggered.connect(self.new_mods_dialog)
+        self.ui.actionDiagnostics.triggered.connect(self.new_diagnostics_dialog)
+        self.ui.actionUndo.triggered.connect(self.undo)
+        self.ui.actionRedo.triggered.connect(self.redo)
+        self.ui.actionChanges.triggered.connect(self.show_changes)
+        self.ui.actionCheckItems.triggered.connect(self.check_items)
+        self.ui.actionFindItem.triggered.connect(self.find_item)
 
-        # populate species combobox
-        for species in self.assets.species().get_species_list():
-            self.ui.race.addItem(species)
+        # species combobox is filled in when the first save is shown, so the
+        # character select dialog doesn't wait on the query
 
         # populate game mode combobox
         for mode in self.assets.player().mode_types.values():
@@ -126,6 +152,12 @@ class MainWindow():
         self.ui.food_button.clicked.connect(lambda: self.max_stat("food"))
         self.ui.breath_button.clicked.connect(lambda: self.max_stat("breath"))
 
+        # look out for the game writing to the open save
+        self.watcher = None
+        self.disk_values = {}
+        self.watch_timer = QTimer()
+        self.watch_timer.timeout.connect(self.check_files)
+
         # launch open file dialog
         self.player = None
         logging.debug("Open file dialog")
@@ -137,14 +169,59 @@ class MainWindow():
 
         self.ui.name.setFocus()
         self.window.setWindowModified(False)
+        self.watch_timer.start(2000)
 
         logging.debug("Showing main window")
         self.window.show()
         sys.exit(self.app.exec_())
 
-    def update(self):
-        """Update all GUI widgets with values from PlayerSave instance."""
+    @tracing.traced
+    @counters.measured
+    def update(self, keys=None):
+        """
+        Update GUI widgets with values from PlayerSave instance. Pass a list of
+        top level entity keys to only refresh the widgets showing them.
+        """
+        # widgets write their new values back through the setters, which
+        # shouldn't end up in the undo history
+        with self.player.history.pause():
+            if keys is None:
+                self.update_widgets()
+            else:
+                sections = []
+                for key in keys:
+                    section = entity_sections.get(key)
+                    if section is not None and section not in sections:
+                        sections.append(section)
+                logging.info("Updating main window sections: %s", ", ".join(sections))
+                for section in sections:
+                    getattr(self, section)()
+                if "update_identity" in sections:
+                    self.update_player_preview()
+        self.update_undo_actions()
+
+    def update_widgets(self):
         logging.info("Updating main window")
+        self.update_identity()
+        self.update_description()
+        self.update_game_mode()
+        self.update_stats()
+        self.update_inventory()
+        self.update_player_preview()
+
+    def populate_species(self):
+        """Fill the species combobox, once."""
+        if self.ui.race.count() > 0:
+            return
+        logging.debug("Populating species list")
+        # adding the first item selects it, which isn't the player changing race
+        self.ui.race.blockSignals(True)
+        for species in self.assets.species().get_species_list():
+            self.ui.race.addItem(species)
+        self.ui.race.blockSignals(False)
+
+    def update_identity(self):
+        self.populate_species()
         # uuid / save version
         self.ui.uuid_label.setText(self.player.get_uuid())
         self.ui.ver_label.setText(self.player.get_header())
@@ -152,27 +229,20 @@ class MainWindow():
         self.ui.name.setText(self.player.get_name())
         # race
         self.ui.race.setCurrentText(self.player.get_race(pretty=True))
-        # BUG: okay so there is this bug where sometimes on windows pyqt will chuck
-        # a fit and not set values on some stuff. this seems to work itself out
-        # when you overwrite the values and reopen the file. i'm going to just
-        # ignore it but would still like a better solution
-        # pixels
-        try:
-            self.ui.pixels.setValue(self.player.get_pixels())
-        except TypeError:
-            logging.exception("Unable to set pixels widget")
-        # description
-        self.ui.description.setPlainText(self.player.get_description())
         # gender
         getattr(self.ui, self.player.get_gender()).toggle()
-        # game mode
+
+    def update_description(self):
+        self.ui.description.setPlainText(self.player.get_description())
+
+    def update_game_mode(self):
         game_mode = self.player.get_game_mode()
         try:
             self.ui.game_mode.setCurrentText(self.assets.player().mode_types[game_mode])
         except KeyError:
             logging.exception("No game mode set on player")
 
-        # stats
+    def update_stats(self):
         for stat in ["health", "energy", "food", "breath", "warmth"]:
             max = getattr(self.player, "get_max_"+stat)()
             getattr(self.ui, "max_"+stat).setValue(int(max))
@@ -183,6 +253,17 @@ class MainWindow():
         except TypeError:
             logging.exception("Unable to set energy regen rate")
 
+    def update_inventory(self):
+        # BUG: okay so there is this bug where sometimes on windows pyqt will chuck
+        # a fit and not set values on some stuff. this seems to work itself out
+        # when you overwrite the values and reopen the file. i'm going to just
+        # ignore it but would still like a better solution
+        # pixels
+        try:
+            self.ui.pixels.setValue(self.player.get_pixels())
+        except TypeError:
+            logging.exception("Unable to set pixels widget")
+
         # equipment
         equip_bags = "head", "chest", "legs", "back"
         for bag in equip_bags:
@@ -199,8 +280,6 @@ class MainWindow():
         self.update_bag("tile_bag")
         self.update_bag("action_bar")
 
-        self.update_player_preview()
-
     def save(self):
         """Update internal player dict with GUI values and export to file."""
         logging.info("Saving player file %s", self.player.filename)
@@ -208,10 +287,115 @@ class MainWindow():
         # save and show status
         logging.info("Writing file to disk")
         logging.debug(self.player.data)
+        self.backup_save()
         self.player.export_save(self.player.filename)
+        self.watch_player()
         self.ui.statusbar.showMessage("Saved " + self.player.filename, 3000)
         self.window.setWindowModified(False)
 
+    def backup_save(self):
+        """Add the save file as it is on disk to the backup store."""
+        config = Config()
+        # older configs don't have the option, backups default to on
+        if config.has_key("make_backups") and config.read("make_backups") != "yes":
+            return
+        import backups
+        try:
+            backups.BackupStore(config.read("backup_folder")).backup(self.player.filename)
+        except (OSError, ValueError):
+            logging.exception("Unable to back up %s", self.player.filename)
+
+    def undo(self):
+        """Revert the last change made to the player."""
+        paths = self.player.undo()
+        if len(paths) > 0:
+            self.update()
+            self.set_edited()
+            self.ui.statusbar.showMessage("Undid %s" % describe_paths(paths), 3000)
+
+    def redo(self):
+        """Reapply the last undone change."""
+        paths = self.player.redo()
+        if len(paths) > 0:
+            self.update()
+            self.set_edited()
+            self.ui.statusbar.showMessage("Redid %s" % describe_paths(paths), 3000)
+
+    def show_changes(self):
+        """List everything that's different from the save file on disk."""
+        self.set_bags()
+        try:
+            changes = saves.format_changes(self.player.diff())
+        except (saves.WrongSaveVer, OSError):
+            logging.exception("Unable to compare with %s", self.player.filename)
+            changes = ["Could not read " + self.player.filename]
+
+        dialog = QMessageBox(self.window)
+        dialog.setWindowTitle("Unsaved Changes")
+        if len(changes) == 0:
+            dialog.setText("No changes from the save file.")
+        else:
+            dialog.setText("%d changes from the save file." % len(changes))
+            dialog.setDetailedText("\n".join(changes))
+        dialog.setIcon(QMessageBox.Information)
+        dialog.exec()
+
+    def check_items(self):
+        """Look for items, blueprints and techs the asset index doesn't know about."""
+        import validate
+        self.set_bags()
+        if self.validator is None:
+            self.validator = validate.SaveValidator(self.assets)
+        problems = self.validator.check(self.player)
+
+        dialog = QMessageBox(self.window)
+        dialog.setWindowTitle("Check Items")
+        if len(problems) == 0:
+            dialog.setText("Everything in this player is in the asset index.")
+            dialog.setIcon(QMessageBox.Information)
+            dialog.exec()
+            return
+
+        dialog.setText("Found %d unknown items, blueprints or techs." % len(problems))
+        dialog.setInformativeText("These are probably from a mod that isn't installed anymore. Remove them?")
+        dialog.setDetailedText("\n".join(validate.format_problems(problems)))
+        dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        dialog.setDefaultButton(QMessageBox.No)
+        dialog.setIcon(QMessageBox.Warning)
+        if dialog.exec() == QMessageBox.Yes:
+            self.validator.strip(self.player, problems)
+            self.update(["inventory"])
+            self.set_edited()
+            self.ui.statusbar.showMessage("Removed %d unknown entries" % len(problems), 3000)
+
+    def find_item(self):
+        """List every character that has an item or knows its blueprint."""
+        name, ok = QInputDialog.getText(self.window, "Find Item", "Item name:")
+        if not ok or name == "":
+            return
+
+        import playerindex
+        index = playerindex.PlayerIndex(os.path.join(Config().config_folder, "players.db"),
+                                        Config().read("player_folder"))
+        index.update()
+        stacks = index.who_has(name)
+        knows = index.who_knows(name)
+
+        dialog = QMessageBox(self.window)
+        dialog.setWindowTitle("Find Item")
+        dialog.setText("%d %s carried by %d characters, %d know the blueprint." %
+                       (index.total(name), name, len(set(x[1] for x in stacks)), len(knows)))
+        lines = ["%s: %d in %s slot %d" % (x[0], x[4], x[2], x[3]) for x in stacks]
+        lines += ["%s: knows the blueprint" % x[0] for x in knows]
+        if len(lines) > 0:
+            dialog.setDetailedText("\n".join(lines))
+        dialog.setIcon(QMessageBox.Information)
+        dialog.exec()
+
+    def update_undo_actions(self):
+        self.ui.actionUndo.setEnabled(self.player.history.can_undo())
+        self.ui.actionRedo.setEnabled(self.player.history.can_redo())
+
     def new_item_edit(self, bag):
         """Display a new item edit dialog using the select cell in a given bag."""
         logging.debug("New item edit dialog")
@@ -225,6 +409,7 @@ class MainWindow():
         else:
             item.update(current.item)
 
+        from gui.itemedit import ItemEdit
         item_edit = ItemEdit(self.window, item,
                              self.player, self.remember_browser)
 
@@ -234,6 +419,7 @@ class MainWindow():
             if new_slot.item["name"] != "":
                 bag.setItem(row, column, new_slot)
                 self.remember_browser = item_edit.remember_browser
+                self.set_bags()
                 self.set_edited()
 
         def trash_slot():
@@ -247,6 +433,7 @@ class MainWindow():
                 logging.debug("Trashed item")
                 bag.setItem(row, column, empty_slot())
                 item_edit.dialog.close()
+                self.set_bags()
                 self.set_edited()
 
         item_edit.dialog.accepted.connect(update_slot)
@@ -255,11 +442,15 @@ class MainWindow():
 
     def set_edited(self):
         self.window.setWindowModified(True)
+        self.update_undo_actions()
 
     def new_blueprint_edit(self):
         """Launch a new blueprint management dialog."""
         logging.debug("New blueprint dialog")
-        blueprint_lib = BlueprintLib(self.window, self.player.get_blueprints())
+        from gui.blueprints import BlueprintLib
+        # the dialog edits the list in place, give it a copy so the old one
+        # can be undone back to
+        blueprint_lib = BlueprintLib(self.window, list(self.player.get_blueprints()))
 
         def update_blueprints():
             logging.debug("Writing blueprints")
@@ -273,6 +464,7 @@ class MainWindow():
 
     def new_item_browser(self):
         """Launch a standalone item browser dialog that does write any changes."""
+        from gui.itembrowser import ItemBrowser
         self.item_browser = ItemBrowser(self.window, True)
         self.item_browser.dialog.show()
 
@@ -283,6 +475,8 @@ class MainWindow():
 
         def write_options():
             logging.info("Writing options to disk")
+            # the index may have been rebuilt
+            self.validator = None
             # TODO: reload icons on asset update?
             self.ui.statusbar.showMessage("Options have been updated", 3000)
 
@@ -295,28 +489,107 @@ class MainWindow():
         about_dialog.dialog.exec()
 
     def new_appearance_dialog(self):
-        appearance_dialog = Appearance(self)
-        appearance_dialog.dialog.exec()
-        appearance_dialog.write_appearance_values()
+        from gui.appearance import Appearance
+        with self.player.history.group():
+            appearance_dialog = Appearance(self)
+            appearance_dialog.dialog.exec()
+            appearance_dialog.write_appearance_values()
         self.update_player_preview()
+        self.update_undo_actions()
 
     def new_techs_dialog(self):
+        from gui.techs import Techs
         techs_dialog = Techs(self)
         techs_dialog.dialog.accepted.connect(techs_dialog.write_techs)
         techs_dialog.dialog.exec()
+        self.update_undo_actions()
 
     def new_mods_dialog(self):
         mods_dialog = ModsDialog(self.window)
         mods_dialog.dialog.show()
 
+    def new_diagnostics_dialog(self):
+        diagnostics_dialog = DiagnosticsDialog(self.window)
+        diagnostics_dialog.dialog.show()
+
     def reload(self):
         """Reload the currently open save file and update GUI values."""
         logging.info("Reloading file %s", self.player.filename)
         self.player = saves.PlayerSave(self.player.filename)
+        self.watch_player()
         self.update()
         self.ui.statusbar.showMessage("Reloaded " + self.player.filename, 3000)
         self.window.setWindowModified(False)
 
+    def watch_player(self):
+        """Start watching the open save (again) from its current state on disk."""
+        self.watcher = watcher.Watcher(self.player.filename, Config().read("player_folder"))
+        # what the file holds now, the open save's own spans are stale once
+        # it has been saved over
+        try:
+            self.disk_values = saves.PlayerSave(self.player.filename, lazy=True).value_digests()
+        except (saves.WrongSaveVer, OSError):
+            logging.exception("Could not read %s", self.player.filename)
+            self.disk_values = {}
+
+    def check_files(self):
+        """Poll for changes made to the open save or player folder outside starcheat."""
+        if self.watcher is None:
+            return
+        # open dialogs hold on to self.player, swapping it from under them
+        # would lose their edits. the change is still there after they close
+        if QApplication.activeModalWidget() is not None:
+            return
+
+        added, removed, modified = self.watcher.folder_changes()
+        if len(added) > 0 or len(removed) > 0 or len(modified) > 0:
+            self.ui.statusbar.showMessage("Player folder changed: %d new, %d removed, %d modified" %
+                                          (len(added), len(removed), len(modified)), 5000)
+
+        if not self.watcher.file_changed():
+            return
+        try:
+            # lazy, so only the values that changed get decoded
+            new_player = saves.PlayerSave(self.player.filename, lazy=True)
+        except (saves.WrongSaveVer, OSError):
+            # probably caught it half written, try again next time
+            logging.debug("Could not read changed save %s", self.player.filename)
+            return
+        self.watcher.reset()
+
+        new_values = new_player.value_digests()
+        changed = sorted(x for x in set(self.disk_values) | set(new_values)
+                         if self.disk_values.get(x) != new_values.get(x))
+        self.disk_values = new_values
+        if len(changed) == 0:
+            return
+        logging.info("Save file changed on disk: %s", ", ".join(changed))
+
+        edited = self.window.isWindowModified()
+        if edited:
+            self.watch_timer.stop()
+            dialog = QMessageBox(self.window)
+            dialog.setWindowTitle("Save File Changed")
+            dialog.setText("The save file was changed outside starcheat, probably by Starbound.")
+            dialog.setInformativeText("Reload it and lose your changes? Otherwise saving will overwrite it.")
+            dialog.setDetailedText("Changed values: " + ", ".join(changed))
+            dialog.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+            dialog.setDefaultButton(QMessageBox.No)
+            dialog.setIcon(QMessageBox.Warning)
+            answer = dialog.exec()
+            self.watch_timer.start()
+            if answer != QMessageBox.Yes:
+                return
+
+        self.player = new_player
+        if edited:
+            # unchanged widgets could still be showing our edits
+            self.update()
+        else:
+            self.update(changed)
+        self.ui.statusbar.showMessage("Reloaded changes to " + self.player.filename, 3000)
+        self.window.setWindowModified(False)
+
     def open_file(self):
         """Display open file dialog and load selected save."""
         if self.window.isWindowModified():
@@ -335,6 +608,7 @@ class MainWindow():
         else:
             self.player = character_select.selected
 
+        self.watch_player()
         self.update()
 
         self.window.setWindowTitle("starcheat - " + self.player.get_name() + "[*]")
@@ -355,14 +629,11 @@ class MainWindow():
     def export_json(self):
         """Export player entity as json."""
         self.set_bags()
-        entity = self.player.entity
-        json_data = json.dumps(entity, sort_keys=True,
-                               indent=4, separators=(',', ': '))
         filename = QFileDialog.getSaveFileName(self.window,
                                                "Export JSON File As")
         if filename[0] != "":
             json_file = open(filename[0], "w")
-            json_file.write(json_data)
+            saves.write_json(self.player.entity, json_file)
             json_file.close()
             self.ui.statusbar.showMessage("Exported JSON file to " + filename[0], 3000)
 
@@ -375,13 +646,23 @@ class MainWindow():
             logging.debug("No player file selected to import")
             return
 
+        imported = 0
         try:
-            player_data = json.load(open(filename[0], "r"))
-            self.player.entity.update(player_data)
+            json_file = open(filename[0], "r")
+            # read a key at a time, the whole import is one undo step
+            with self.player.history.group():
+                for key, value in saves.iter_json_items(json_file):
+                    self.player.set((key,), value)
+                    imported += 1
+            json_file.close()
             self.update()
             self.ui.statusbar.showMessage("Imported player file " + filename[0], 3000)
         except:
             logging.exception("Error parsing player: %s", filename[0])
+            if imported > 0:
+                # don't leave it half imported
+                self.player.undo()
+                self.update()
             self.ui.statusbar.showMessage("Error importing player, see starcheat log for details", 3000)
 
     def get_gender(self):
@@ -394,7 +675,8 @@ class MainWindow():
         """Return the entire contents of a given non-equipment bag as raw values."""
         logging.debug("Getting %s contents", name)
         row = column = 0
-        bag = getattr(self.player, "get_" + name)()
+        # a new list, the old one is kept as is for undo
+        bag = list(getattr(self.player, "get_" + name)())
 
         for i in range(len(bag)):
             item = getattr(self.ui, name).item(row, column)
@@ -452,7 +734,7 @@ class MainWindow():
     def update_player_preview(self):
         try:
             image = self.assets.species().render_player(self.player)
-            pixmap = QPixmap.fromImage(ImageQt(image)).scaled(86, 86)
+            pixmap = image_pixmap(image).scaled(86, 86)
         except (OSError, TypeError, AttributeError):
             # TODO: more specific error handling. may as well except all errors
             # at this point jeez
@@ -467,23 +749,30 @@ class MainWindow():
         if self.player.get_race(pretty=True) == species:
             # don't overwrite appearance values if it didn't really change
             return
-        self.player.set_race(species)
-        defaults = self.assets.species().get_default_colors(species)
-        for key in defaults:
-            getattr(self.player, "set_%s_directives" % key)(defaults[key])
+        with self.player.history.group():
+            self.player.set_race(species)
+            defaults = self.assets.species().get_default_colors(species)
+            for key in defaults:
+                getattr(self.player, "set_%s_directives" % key)(defaults[key])
         self.update_player_preview()
         self.window.setWindowModified(True)
 
+    # widgets that change a value as it's typed or dragged tag the changes
+    # with their name, so a run of them becomes one undo step
+
     def set_pixels(self):
-        self.player.set_pixels(self.ui.pixels.value())
+        with self.player.history.coalescing("pixels"):
+            self.player.set_pixels(self.ui.pixels.value())
         self.set_edited()
 
     def set_name(self):
-        self.player.set_name(self.ui.name.text())
+        with self.player.history.coalescing("name"):
+            self.player.set_name(self.ui.name.text())
         self.set_edited()
 
     def set_description(self):
-        self.player.set_description(self.ui.description.toPlainText())
+        with self.player.history.coalescing("description"):
+            self.player.set_description(self.ui.description.toPlainText())
         self.set_edited()
 
     def set_gender(self):
@@ -496,21 +785,23 @@ class MainWindow():
         self.set_edited()
 
     def set_energy_regen(self):
-        self.player.set_energy_regen(self.ui.energy_regen.value())
+        with self.player.history.coalescing("energy_regen"):
+            self.player.set_energy_regen(self.ui.energy_regen.value())
         self.set_edited()
 
     def set_bags(self):
         # this function mostly just exist to work around the bug of
         # dragndrop not updating player entity. this requires the table view
         # equipment
-        equip_bags = "head", "chest", "legs", "back"
-        for b in equip_bags:
-            bag = self.get_equip(b)
-            getattr(self.player, "set_" + b)(bag[0], bag[1])
-        # bags
-        bags = "wieldable", "main_bag", "tile_bag", "action_bar"
-        for b in bags:
-            getattr(self.player, "set_" + b)(self.get_bag(b))
+        with self.player.history.group():
+            equip_bags = "head", "chest", "legs", "back"
+            for b in equip_bags:
+                bag = self.get_equip(b)
+                getattr(self.player, "set_" + b)(bag[0], bag[1])
+            # bags
+            bags = "wieldable", "main_bag", "tile_bag", "action_bar"
+            for b in bags:
+                getattr(self.player, "set_" + b)(self.get_bag(b))
 
     def max_stat(self, name):
         """Set a stat's current value to its max value."""
@@ -521,13 +812,15 @@ class MainWindow():
     def set_stat(self, name):
         max = getattr(self.ui, "max_"+name).value()
         logging.debug("Setting max %s", name)
-        getattr(self.player, "set_max_"+name)(float(max))
+        with self.player.history.coalescing("max_" + name):
+            getattr(self.player, "set_max_"+name)(float(max))
         self.update_stat(name)
 
     def set_stat_slider(self, name):
         current = getattr(self.ui, name).value()
         max = getattr(self.player, "get_max_"+name)()
-        getattr(self.player, "set_"+name)(float(current), max)
+        with self.player.history.coalescing(name):
+            getattr(self.player, "set_"+name)(float(current), max)
         self.update_stat(name)
 
     def update_stat(self, name):
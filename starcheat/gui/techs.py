@@ -6,9 +6,9 @@ import os, logging
 
 from PyQt5.QtWidgets import QDialog, QListWidgetItem
 from PyQt5.QtGui import QPixmap, QImage, QIcon, QBrush, QColor
-from PIL.ImageQt import ImageQt
 
-import assets, qt_techs
+import assets, qt_techs, tracing
+from gui.common import image_pixmap
 from config import Config
 
 def new_tech_slot(tech_asset):
@@ -20,7 +20,31 @@ def new_tech_slot(tech_asset):
 
     return module
 
+class TechCatalog():
+    """Every indexed tech with its techitem and icon, read once per asset index."""
+    def __init__(self, db):
+        self.generation = db.generation()
+        self.names = db.techs().all()
+        # name: (techitem, 32x32 icon pixmap, tech asset key)
+        self.techs = {}
+        for name in self.names:
+            try:
+                info, image, key = db.techs().get_tech(name)
+                self.techs[name] = (info, image_pixmap(image).scaled(32,32), key)
+            except (TypeError, KeyError):
+                logging.exception("Couldn't load tech: %s", name)
+
+# shared by every techs dialog until the index changes
+catalog = None
+
+def get_catalog(db):
+    global catalog
+    if catalog is None or catalog.generation != db.generation():
+        catalog = TechCatalog(db)
+    return catalog
+
 class Techs():
+    @tracing.traced
     def __init__(self, main_window):
         self.dialog = QDialog(main_window.window)
         self.ui = qt_techs.Ui_Dialog()
@@ -31,6 +55,7 @@ class Techs():
         self.assets = assets.Assets(Config().read("assets_db"),
                                     starbound_folder)
         self.player = main_window.player
+        self.catalog = get_catalog(self.assets)
 
         self.selected_tech = None
 
@@ -42,17 +67,15 @@ class Techs():
         # populate equipped techs
         current = 1
         for i in self.player.get_tech_modules():
-            try:
-                tech_name = os.path.basename(i["modulePath"].replace(".tech",""))
-                tech = self.assets.techs().get_tech(tech_name)
-                icon = QPixmap.fromImage(ImageQt(tech[1]))
-                getattr(self.ui, "icon"+str(current)).setPixmap(icon.scaled(32,32))
+            tech_name = os.path.basename(i["modulePath"].replace(".tech",""))
+            tech = self.catalog.techs.get(tech_name)
+            if tech is not None:
+                getattr(self.ui, "icon"+str(current)).setPixmap(tech[1])
                 getattr(self.ui, "icon"+str(current)).setToolTip(tech[0]["shortdescription"])
                 self.techs[current-1] = i
                 self.equip[current-1] = tech[0]["itemName"]
-            except TypeError:
-                logging.exception("Couldn't load tech: %s", i["modulePath"])
-                pass
+            else:
+                logging.warning("Couldn't load tech: %s", i["modulePath"])
 
             current += 1
 
@@ -66,30 +89,37 @@ class Techs():
         self.ui.icon3_button.clicked.connect(lambda: self.set_tech(2))
         self.ui.icon4_button.clicked.connect(lambda: self.set_tech(3))
 
-        known_recipes = [x["name"] for x in self.player.get_blueprints()]
+        known_recipes = set(x["name"] for x in self.player.get_blueprints())
         self.ui.tech_list.clear()
-        for tech in self.assets.techs().all():
+        for tech in self.catalog.names:
             item = QListWidgetItem(tech)
             if tech in known_recipes:
                 item.setBackground(QBrush(QColor("lightBlue")))
             self.ui.tech_list.addItem(item)
 
+    def selected(self):
+        item = self.ui.tech_list.currentItem()
+        if item is None:
+            return None
+        return self.catalog.techs.get(item.text())
+
     def update_selection(self):
-        tech_name = self.ui.tech_list.currentItem().text()
-        tech = self.assets.techs().get_tech(tech_name)
+        tech = self.selected()
+        if tech is None:
+            return
 
         tech_info = "<strong>"+tech[0]["shortdescription"]+"</strong><br>"
         tech_info += "("+tech[0]["itemName"]+")"
         tech_info += "<p>"+tech[0]["description"]+"</p>"
 
         self.ui.tech_info.setText(tech_info)
-        self.ui.current_icon.setPixmap(QPixmap.fromImage(ImageQt(tech[1])).scaled(32,32))
+        self.ui.current_icon.setPixmap(tech[1])
 
     def set_tech(self, index):
-        tech_name = self.ui.tech_list.currentItem().text()
-        tech = self.assets.techs().get_tech(tech_name)
-        icon = QPixmap.fromImage(ImageQt(tech[1]))
-        getattr(self.ui, "icon"+str(index+1)).setPixmap(icon.scaled(32,32))
+        tech = self.selected()
+        if tech is None:
+            return
+        getattr(self.ui, "icon"+str(index+1)).setPixmap(tech[1])
         getattr(self.ui, "icon"+str(index+1)).setToolTip(tech[0]["shortdescription"])
         self.techs[index] = new_tech_slot(tech[2])
         self.equip[index] = tech[0]["itemName"]
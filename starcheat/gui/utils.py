@@ -2,13 +2,13 @@
 Utility dialogs for starcheat itself
 """
 
-import os, sys, platform, subprocess, shutil
+import os, sys, time, platform, subprocess, shutil, sqlite3
 from PyQt5.QtWidgets import QDialog, QFileDialog, QMessageBox
-from PyQt5.QtWidgets import QListWidgetItem, QProgressDialog
+from PyQt5.QtWidgets import QListWidgetItem, QProgressDialog, QTableWidgetItem
 from PyQt5 import QtGui, QtCore
 
-import saves, assets, logging, config
-import qt_options, qt_openplayer, qt_about, qt_mods
+import saves, assets, logging, config, tracing, counters
+import qt_options, qt_openplayer, qt_about, qt_mods, qt_diagnostics
 from config import Config
 from gui.common import preview_icon
 
@@ -43,7 +43,18 @@ def build_assets_db(parent):
         os.remove(assets_db_file)
 
     assets_db.init_db()
-    asset_files = assets_db.find_assets()
+
+    # vanilla assets are identical everywhere, so reuse a prebuilt index of
+    # them if we have one and only scan the mods on top
+    snapshot_folder = os.path.join(config.config_folder, "snapshots")
+    snapshot = assets_db.find_snapshot(snapshot_folder)
+    if snapshot is not None:
+        logging.info("Importing vanilla index snapshot %s", snapshot)
+        assets_db.import_snapshot(snapshot)
+        asset_files = assets_db.find_mod_assets()
+    else:
+        asset_files = assets_db.find_assets()
+
     total = 0
     progress = QProgressDialog("Indexing Starbound assets...",
                                "Cancel", 0, len(asset_files),
@@ -51,20 +62,29 @@ def build_assets_db(parent):
     progress.setWindowModality(QtCore.Qt.ApplicationModal)
     progress.forceShow()
 
-    for i in assets_db.create_index():
-        total += 1
-        progress.setValue(total)
-        if progress.wasCanceled():
-            assets_db.db.close()
-            os.remove(assets_db_file)
-            return False
+    # create_index is a generator, so the span goes around the whole loop
+    # rather than inside it where it would stop at every yield
+    with tracing.span("Assets.create_index"):
+        for i in assets_db.create_index(asset_files):
+            total += 1
+            progress.setValue(total)
+            if progress.wasCanceled():
+                assets_db.db.close()
+                os.remove(assets_db_file)
+                return False
 
     progress.hide()
-    if total == 0:
+    if assets_db.total_indexed() == 0:
         bad_asset_dialog()
         return False
-    else:
-        return True
+
+    if snapshot is None:
+        try:
+            snapshot = assets_db.export_snapshot(snapshot_folder)
+            logging.info("Wrote vanilla index snapshot %s", snapshot)
+        except (OSError, sqlite3.Error):
+            logging.exception("Unable to write index snapshot")
+    return True
 
 def save_modified_dialog(parent):
     """Display a prompt asking user what to do about a modified file. Return button clicked."""
@@ -183,6 +203,7 @@ def unpack_assets():
         sys.exit()
 
 class AboutDialog():
+    @tracing.traced
     def __init__(self, parent):
         self.dialog = QDialog(parent)
         self.ui = qt_about.Ui_Dialog()
@@ -192,6 +213,7 @@ class AboutDialog():
         self.ui.header_info.setText(set_ver)
 
 class OptionsDialog():
+    @tracing.traced
     def __init__(self, parent):
         self.dialog = QDialog(parent)
         self.ui = qt_options.Ui_Dialog()
@@ -259,6 +281,7 @@ class OptionsDialog():
 
 # TODO: support stuff like sorting by date (needs to be a table widget)
 class CharacterSelectDialog():
+    @tracing.traced
     def __init__(self, parent):
         self.dialog = QDialog(parent)
         self.ui = qt_openplayer.Ui_OpenPlayer()
@@ -281,7 +304,7 @@ class CharacterSelectDialog():
     def accept(self):
         player = self.ui.player_list.currentItem().text()
         if player != "":
-            self.selected = self.players[player]
+            self.selected = self.players[player].open()
             self.dialog.close()
 
     def get_players(self):
@@ -291,8 +314,8 @@ class CharacterSelectDialog():
             for f in os.listdir(self.player_folder):
                 if f.endswith(".player"):
                     try:
-                        player = saves.PlayerSave(os.path.join(self.player_folder, f))
-                        players_found[player.get_name()] = player
+                        player = saves.PlayerSummary.read(os.path.join(self.player_folder, f))
+                        players_found[player.name] = player
                     except saves.WrongSaveVer:
                         logging.info("Save file %s is not compatible", f)
         except FileNotFoundError:
@@ -305,8 +328,8 @@ class CharacterSelectDialog():
         self.ui.player_list.clear()
         for player in self.players.keys():
             list_item = QListWidgetItem(player)
-            race = self.players[player].get_race()
-            gender = self.players[player].get_gender()
+            race = self.players[player].race
+            gender = self.players[player].gender
             list_item.setIcon(QtGui.QIcon(preview_icon(race, gender)))
             self.ui.player_list.addItem(list_item)
             total += 1
@@ -327,7 +350,7 @@ class CharacterSelectDialog():
     def trash_player(self):
         """Move all player files to backup folder set in config file."""
         player = self.ui.player_list.currentItem().text()
-        uuid = self.players[player].get_uuid()
+        uuid = self.players[player].uuid
         player_files = []
 
         # are you sure?
@@ -364,6 +387,7 @@ class CharacterSelectDialog():
         self.populate()
 
 class ModsDialog():
+    @tracing.traced
     def __init__(self, parent):
         self.dialog = QDialog(parent)
         self.ui = qt_mods.Ui_Dialog()
@@ -373,7 +397,51 @@ class ModsDialog():
         self.assets = assets.Assets(Config().read("assets_db"),
                                     starbound_folder)
 
-        mods = self.assets.get_mods()
+        mods = self.assets.get_sources(mods_only=True)
+        stats = self.assets.get_source_stats()
         self.ui.mods_total.setText(str(len(mods))+" total")
-        for mod in mods:
-            self.ui.mods_list.addItem(mod)
+        for path, kind, asset_count, index_time in mods:
+            list_item = QListWidgetItem("%s (%d assets)" % (path, asset_count))
+            counts = stats.get(path, {})
+            list_item.setToolTip("\n".join(["%s, indexed %s" % (kind, time.ctime(index_time))] +
+                                           ["%s: %d" % (x, counts[x]) for x in sorted(counts)]))
+            self.ui.mods_list.addItem(list_item)
+
+class DiagnosticsDialog():
+    @tracing.traced
+    def __init__(self, parent):
+        self.dialog = QDialog(parent)
+        self.ui = qt_diagnostics.Ui_Dialog()
+        self.ui.setupUi(self.dialog)
+
+        self.ui.reset_button.clicked.connect(self.reset)
+
+        # counters keep changing while other windows are used
+        self.timer = QtCore.QTimer(self.dialog)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        current = counters.snapshot()
+        rows = [(k, str(v)) for k, v in sorted(current["counts"].items())]
+        rows += [(k + " (secs)", "%.3f" % v) for k, v in sorted(current["timings"].items())]
+
+        self.ui.counters.setRowCount(len(rows))
+        for row, counter in enumerate(rows):
+            self.ui.counters.setItem(row, 0, QTableWidgetItem(counter[0]))
+            self.ui.counters.setItem(row, 1, QTableWidgetItem(counter[1]))
+
+        operations = []
+        for name, result in sorted(counters.operations.items()):
+            costs = ["%s: %s" % x for x in sorted(result["counts"].items())]
+            costs += ["%s: %.3fs" % x for x in sorted(result["timings"].items())]
+            operations.append("%s\n    %s" % (name, "\n    ".join(costs)))
+        self.ui.operations.setPlainText("\n".join(operations))
+
+        slow = ["%s %.3fs %s" % x for x in counters.slow_queries]
+        self.ui.slow_queries.setPlainText("\n".join(slow))
+
+    def reset(self):
+        counters.reset()
+        self.refresh()
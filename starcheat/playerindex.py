@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Index of what every character in the player folder is carrying
+
+Keeps an sqlite table of item name -> (save file, container, slot, count)
+for the bags, equipment and blueprints of each .player file. A save is only
+decoded again when its mtime or size changes, so asking who has an item is a
+single indexed query. From the command line:
+
+$ python ./playerindex.py -i <item name>      # who has it and how many
+$ python ./playerindex.py -r <recipe name>    # who knows it
+"""
+
+import os, sqlite3, logging
+from optparse import OptionParser
+
+import saves
+
+# inventory lists that hold items
+containers = ("bag", "tileBag", "actionBar", "wieldable", "equipment")
+
+class PlayerIndex():
+    def __init__(self, db_file, player_folder):
+        self.db_file = db_file
+        self.player_folder = player_folder
+        self.db = sqlite3.connect(db_file)
+        self.init_db()
+
+    def init_db(self):
+        c = self.db.cursor()
+        c.execute("""create table if not exists players
+            (filename text primary key, mtime real, size integer, uuid text, name text)""")
+        c.execute("""create table if not exists contents
+            (filename text, container text, slot integer, item text, count integer)""")
+        c.execute("create index if not exists contents_item on contents (item)")
+        c.execute("create index if not exists contents_file on contents (filename)")
+        self.db.commit()
+
+    def update(self):
+        """
+        Reindex saves that changed since last time and drop ones that are
+        gone. Returns the number of saves (reindexed, removed).
+        """
+        c = self.db.cursor()
+        c.execute("select filename, mtime, size from players")
+        known = {x[0]: (x[1], x[2]) for x in c.fetchall()}
+
+        try:
+            found = [x for x in os.listdir(self.player_folder) if x.endswith(".player")]
+        except OSError:
+            logging.exception("Could not open %s", self.player_folder)
+            found = []
+
+        reindexed = 0
+        for filename in found:
+            try:
+                stat = os.stat(os.path.join(self.player_folder, filename))
+            except OSError:
+                continue
+            if known.get(filename) == (stat.st_mtime, stat.st_size):
+                continue
+            if self.index_player(filename, stat):
+                reindexed += 1
+
+        removed = [x for x in known if x not in found]
+        for filename in removed:
+            self.remove_player(filename)
+
+        self.db.commit()
+        if reindexed > 0 or len(removed) > 0:
+            logging.info("Player index: %d reindexed, %d removed", reindexed, len(removed))
+        return reindexed, len(removed)
+
+    def remove_player(self, filename):
+        c = self.db.cursor()
+        c.execute("delete from players where filename = ?", (filename,))
+        c.execute("delete from contents where filename = ?", (filename,))
+
+    def index_player(self, filename, stat):
+        try:
+            # lazy, only the inventory and blueprints get decoded
+            player = saves.PlayerSave(os.path.join(self.player_folder, filename), lazy=True)
+        except (saves.WrongSaveVer, OSError):
+            logging.info("Save file %s is not compatible", filename)
+            # remember it anyway so it isn't decoded again until it changes
+            self.remove_player(filename)
+            self.db.cursor().execute("insert into players values (?, ?, ?, null, null)",
+                                     (filename, stat.st_mtime, stat.st_size))
+            return False
+
+        rows = []
+        inventory = player.entity.get("inventory", {})
+        for container in containers:
+            slots = inventory.get(container, [])
+            for slot in range(len(slots)):
+                item = slots[slot]
+                if isinstance(item, dict) and item.get("name", "") != "":
+                    rows.append((filename, container, slot, item["name"], item.get("count", 1)))
+
+        blueprints = player.get_blueprints()
+        for slot in range(len(blueprints)):
+            rows.append((filename, "blueprints", slot, blueprints[slot]["name"], 1))
+
+        self.remove_player(filename)
+        c = self.db.cursor()
+        c.execute("insert into players values (?, ?, ?, ?, ?)",
+                  (filename, stat.st_mtime, stat.st_size, player.get_uuid(), player.get_name()))
+        c.executemany("insert into contents values (?, ?, ?, ?, ?)", rows)
+        return True
+
+    def who_has(self, item):
+        """Return (name, filename, container, slot, count) of every stack of an item."""
+        c = self.db.cursor()
+        c.execute("""select p.name, c.filename, c.container, c.slot, c.count
+            from contents c join players p on p.filename = c.filename
+            where c.item = ? and c.container != 'blueprints'
+            order by p.name, c.container, c.slot""", (item,))
+        return c.fetchall()
+
+    def total(self, item):
+        """Return how many of an item there are across every character."""
+        c = self.db.cursor()
+        c.execute("""select coalesce(sum(count), 0) from contents
+            where item = ? and container != 'blueprints'""", (item,))
+        return c.fetchone()[0]
+
+    def who_knows(self, recipe):
+        """Return (name, filename) of every character that knows a blueprint."""
+        c = self.db.cursor()
+        c.execute("""select distinct p.name, c.filename
+            from contents c join players p on p.filename = c.filename
+            where c.item = ? and c.container = 'blueprints' order by p.name""", (recipe,))
+        return c.fetchall()
+
+    def search(self, pattern):
+        """Return (item, total count, characters) of items whose name is like pattern."""
+        c = self.db.cursor()
+        c.execute("""select item, sum(count), count(distinct filename) from contents
+            where item like ? and container != 'blueprints'
+            group by item order by item""", (pattern,))
+        return c.fetchall()
+
+def main():
+    parser = OptionParser(description="finds items and blueprints across every starbound character")
+    parser.add_option("-i", "--item", dest="item", help="list who has this item")
+    parser.add_option("-r", "--recipe", dest="recipe", help="list who knows this blueprint")
+    parser.add_option("-s", "--search", dest="search",
+                      help="list items matching this sqlite like pattern, e.g. %ore%")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    import config
+    from config import Config
+
+    index = PlayerIndex(os.path.join(config.config_folder, "players.db"),
+                        Config().read("player_folder"))
+    index.update()
+
+    if options.item is not None:
+        for name, filename, container, slot, count in index.who_has(options.item):
+            print("%-20s %-12s %4d x%-6d %s" % (name, container, slot, count, filename))
+        print("%d %s in total" % (index.total(options.item), options.item))
+    if options.recipe is not None:
+        for name, filename in index.who_knows(options.recipe):
+            print("%-20s %s" % (name, filename))
+    if options.search is not None:
+        for item, count, players in index.search(options.search):
+            print("%-30s %8d on %d characters" % (item, count, players))
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,30 @@ edit it how you like and then export it again.
 
 It can also be run from the command line to dump the contents, like this:
 $ python ./save_file.py <.player file>
+
+Saves can be opened lazily with PlayerSave(filename, lazy=True). Lists and
+dicts are then returned as LazyList/LazyDict proxies which only remember
+where their bytes are and decode themselves the first time they're used, so
+reading one value out of a save doesn't build the whole entity. Opening
+still skips over the save once to find where every list and dict ends.
+
+Either way dicts and lists keep a view of their original bytes, so export
+only encodes what changed. PlayerSave(filename, track=False) decodes plain
+dicts and lists instead, for reading a save through once.
+
+PlayerSave(filename, intern=table) shares dict keys, strings and ints between
+every save opened with the same table dict. It's for scripts holding many
+saves in memory at once, nothing in starcheat itself does that (the
+character list only keeps a PlayerSummary of each).
 """
 
-import sys, logging, struct, os
+import sys, logging, struct, os, copy, time, collections, json, hashlib
+from json.encoder import encode_basestring_ascii
 from pprint import pprint
 from struct import pack, unpack_from
 
+import tracing
+
 # compatible save version
 data_version = "SBVJ01"
 # this is the complete data format definition for a .player file. formats
@@ -150,26 +168,26 @@ def pack_variant3(var):
 
 # variant list
 # <vlq total><variant>...
-def unpack_variant6(data):
+def unpack_variant6(data, lazy=False, track=False, table=None, ends=None, base=0):
     total = unpack_vlq(data)
     offset = total[1]
     variants = []
     for i in range(total[0]):
-        variant = unpack_variant(data[offset:])
+        variant = unpack_variant(data[offset:], lazy, track, table, ends, base + offset)
         variants.append(variant[0])
         offset += variant[1]
     return variants, offset
 
 def pack_variant6(var):
     total = len(var)
-    variant_list = b""
+    variant_list = [pack_vlq(total)]
     for variant in var:
-        variant_list += pack_variant(variant)
-    return pack_vlq(total) + variant_list
+        variant_list.append(pack_variant(variant))
+    return b"".join(variant_list)
 
 # variant dict
 # <vlq total><vlq key str len><str key><variant>...
-def unpack_variant7(data):
+def unpack_variant7(data, lazy=False, track=False, table=None, ends=None, base=0):
     total = unpack_vlq(data)
     offset = total[1]
     dict_items = {}
@@ -177,30 +195,130 @@ def unpack_variant7(data):
         for i in range(total[0]):
             key = unpack_vlq_str(data[offset:])
             offset += key[1]
-            value = unpack_variant(data[offset:])
+            value = unpack_variant(data[offset:], lazy, track, table, ends, base + offset)
             offset += value[1]
-            dict_items[key[0]] = value[0]
+            if table is not None:
+                # in the table too rather than sys.intern, so keys go when
+                # the caller drops it
+                dict_items[table.setdefault(key[0], key[0])] = value[0]
+            else:
+                dict_items[key[0]] = value[0]
     return dict_items, offset
 
 def pack_variant7(var):
     total = len(var)
-    dict_items = b""
-    for k in var.keys():
-        logging.debug(k)
-        key = pack_vlq_str(k)
-        value = pack_variant(var[k])
-        dict_items += key + value
-    return pack_vlq(total) + dict_items
-
-def unpack_variant(data):
+    dict_items = [pack_vlq(total)]
+    for k, v in var.items():
+        dict_items.append(pack_vlq_str(k))
+        dict_items.append(pack_variant(v))
+    return b"".join(dict_items)
+
+def unpack_variant(data, lazy=False, track=False, table=None, ends=None, base=0):
+    """
+    Decode the variant at the start of data and return (value, length).
+
+    In lazy mode ends maps the offset of every container inside the outermost
+    lazy value to where it ends, offsets being relative to where base is
+    counted from. It's filled in by the one skip over that value, so loading
+    the proxies inside it doesn't walk their subtrees again.
+    """
     variant_type = unpack_vlq(data)
     offset = variant_type[1]
+    if variant_type[0] in lazy_types:
+        if lazy:
+            if ends is None:
+                ends = {}
+            # just find where it ends, decoding waits until it's used
+            end = skip_variant(data, 0, ends, base)
+            proxy = lazy_types[variant_type[0]](data[offset:end])
+            proxy._table = table
+            proxy._ends = ends
+            proxy._base = base + offset
+            return proxy, end
+        elif track:
+            # decode now but keep the original bytes for export
+            unpacked = variant_types[variant_type[0]][0](data[offset:], False, True, table)
+            end = offset + unpacked[1]
+            return lazy_types[variant_type[0]].loaded(unpacked[0], data[offset:end]), end
+        unpacked = variant_types[variant_type[0]][0](data[offset:], False, False, table)
+        return unpacked[0], offset + unpacked[1]
     unpacked = variant_types[variant_type[0]][0](data[offset:])
     offset += unpacked[1]
+    if table is not None:
+        return intern_value(table, variant_type[0], unpacked[0]), offset
     return unpacked[0], offset
 
+def intern_value(table, variant_type, value):
+    """
+    Return the equal string or int already in table, adding value if it's new.
+
+    Only immutable leaves are shared. Dicts and lists are edited in place by
+    the setters and lazy proxies point back at their parent, so every
+    container stays its own object. Floats aren't either, they're mostly
+    unique and an entry for each would cost more than sharing saves.
+    """
+    if variant_type == 5 or variant_type == 4:
+        # strings and ints never compare equal, so they can share a table
+        return table.setdefault(value, value)
+    return value
+
+def read_vlq(data, offset):
+    """Return a VLQ number at offset and the offset just past it."""
+    value = 0
+    while True:
+        tmp = data[offset]
+        value = (value<<7) | (tmp&0x7f)
+        offset += 1
+        if tmp & 0x80 == 0:
+            return value, offset
+
+def skip_variant(data, offset, ends=None, base=0):
+    """
+    Return the offset just past the variant at offset without decoding it.
+
+    If given, ends is checked for and filled in with where each container
+    ends, see unpack_variant.
+    """
+    variant_type, offset = read_vlq(data, offset)
+    return skip_value(variant_type, data, offset, ends, base)
+
+def skip_value(variant_type, data, offset, ends=None, base=0):
+    """Like skip_variant for a value whose type has already been read."""
+    if ends is not None and variant_type >= 6:
+        # each container is only skipped again once, by the proxy decoding
+        # the one it's in, so its entry isn't needed after that
+        end = ends.pop(base + offset, None)
+        if end is not None:
+            return end - base
+        start = offset
+    if variant_type == 1:
+        return offset
+    elif variant_type == 2:
+        return offset + 8
+    elif variant_type == 3:
+        return offset + 1
+    elif variant_type == 4:
+        return read_vlq(data, offset)[1]
+    elif variant_type == 5:
+        length, offset = read_vlq(data, offset)
+        return offset + length
+    elif variant_type == 6:
+        total, offset = read_vlq(data, offset)
+        for i in range(total):
+            offset = skip_variant(data, offset, ends, base)
+    elif variant_type == 7:
+        total, offset = read_vlq(data, offset)
+        for i in range(total):
+            length, offset = read_vlq(data, offset)
+            offset = skip_variant(data, offset + length, ends, base)
+    else:
+        raise WrongSaveVer("Unsupported variant type")
+    if ends is not None:
+        ends[base + start] = base + offset
+    return offset
+
 def pack_variant(var):
-    if var == None:
+    if var is None:
         return b'\x01' + variant_types[1][1](var)
     elif type(var) is float:
         return b'\x02' + variant_types[2][1](var)
@@ -210,14 +328,18 @@ def pack_variant(var):
         return b'\x04' + variant_types[4][1](var)
     elif type(var) is str:
         return b'\x05' + variant_types[5][1](var)
-    elif type(var) is list:
+    elif isinstance(var, list):
+        if type(var) is LazyList and not var.is_dirty():
+            return b'\x06' + var.span()
         return b'\x06' + variant_types[6][1](var)
-    elif type(var) is dict:
+    elif isinstance(var, dict):
+        if type(var) is LazyDict and not var.is_dirty():
+            return b'\x07' + var.span()
         return b'\x07' + variant_types[7][1](var)
     else:
         raise WrongSaveVer("Unsupported variant type")
 
-def unpack_starsave(data):
+def unpack_starsave(data, lazy=False, track=False, table=None):
     save = {}
 
     entity_name = unpack_vlq_str(data)
@@ -228,7 +350,7 @@ def unpack_starsave(data):
     save["variant_version"] = variant_ver[0]
     offset += 4
 
-    save_data = unpack_variant6(data[offset:])
+    save_data = unpack_variant6(data[offset:], lazy, track, table)
     # TODO: this will work but might break
     # need a way to figure the right list item on the fly?
     save["data"] = save_data[0][0]
@@ -250,19 +372,19 @@ def pack_starsave(var):
     return data
 
 # just grabs any remaining bytes
-def unpack_the_rest(data):
-    return data, len(data)
+def unpack_the_rest(data, lazy=False, track=False, table=None):
+    return bytes(data), len(data)
 
 def pack_the_rest(var):
     return var
 
 # unpack any starbound save type
-def unpack_var(var, data):
+def unpack_var(var, data, lazy=False, track=False, table=None):
     pattern = var[1]
     length = var[2]
 
     if pattern in save_file_types:
-        return save_file_types[pattern][0](data)
+        return save_file_types[pattern][0](data, lazy, track, table)
     else:
         return unpack_from(pattern, data, 0), length
 
@@ -302,6 +424,553 @@ variant_types = (
     (unpack_variant7, pack_variant7)
 )
 
+def mark_dirty(proxy):
+    """Flag a proxy and every proxy it was decoded from as modified."""
+    while proxy is not None and not proxy._dirty:
+        proxy._dirty = True
+        proxy = proxy._parent
+
+def adopt(proxy):
+    """Point the proxies directly inside a decoded proxy back at it."""
+    values = proxy.values() if isinstance(proxy, dict) else proxy
+    for value in values:
+        if type(value) is LazyDict or type(value) is LazyList:
+            value._parent = proxy
+
+def loading(method):
+    """Wrap a container method so it decodes the proxy before running."""
+    def wrapper(self, *args, **kwargs):
+        if self._data is not None:
+            self.load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+def mutating(method):
+    """Like loading, but the proxy can no longer be exported as-is."""
+    def wrapper(self, *args, **kwargs):
+        if self._data is not None:
+            self.load()
+        if not self._dirty:
+            mark_dirty(self)
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+# setting one of these to an equal value doesn't need a re-encode
+scalar_types = (type(None), bool, int, float, str)
+
+def same_value(old, new):
+    return old is new or (type(old) is type(new) and type(new) in scalar_types and old == new)
+
+class LazyDict(dict):
+    """
+    Variant dict that decodes itself from its encoded bytes on first use.
+
+    It also keeps those original bytes, and until it (or anything inside it)
+    is modified pack_variant copies them out as they are instead of encoding
+    it again.
+
+    Everything going through the dict methods works as normal. C code that
+    reads dicts directly (e.g. compact json.dumps) can see an empty dict, so
+    call unlazy() on a value before handing it to something like that.
+    """
+    __slots__ = ("_data", "_span", "_parent", "_dirty", "_table", "_ends", "_base")
+
+    def __init__(self, data):
+        dict.__init__(self)
+        # memoryview of the encoded dict, None once it has been decoded
+        self._data = data
+        self._span = data
+        # the proxy this one was decoded from
+        self._parent = None
+        self._dirty = False
+        # intern table to decode with, see intern_value
+        self._table = None
+        # container ends found when this was skipped and where the data
+        # starts in their offsets, see unpack_variant
+        self._ends = None
+        self._base = 0
+
+    @classmethod
+    def loaded(cls, value, span):
+        proxy = cls(None)
+        dict.update(proxy, value)
+        proxy._span = span
+        adopt(proxy)
+        return proxy
+
+    def load(self):
+        data = self._data
+        if data is not None:
+            self._data = None
+            dict.update(self, unpack_variant7(data, True, False, self._table,
+                                              self._ends, self._base)[0])
+            self._ends = None
+            adopt(self)
+        return self
+
+    def is_loaded(self):
+        return self._data is None
+
+    def is_dirty(self):
+        return self._dirty or self._span is None
+
+    def span(self):
+        """The original encoded bytes, without the variant type."""
+        return self._span
+
+    def __setitem__(self, key, value):
+        if self._data is not None:
+            self.load()
+        if not self._dirty and not (key in self and same_value(dict.__getitem__(self, key), value)):
+            mark_dirty(self)
+        dict.__setitem__(self, key, value)
+
+    def __eq__(self, other):
+        self.load()
+        if isinstance(other, (LazyDict, LazyList)):
+            other.load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __copy__(self):
+        return dict(self.load())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self.load()), memo)
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self.load()),)
+
+class LazyList(list):
+    """Variant list version of LazyDict."""
+    __slots__ = ("_data", "_span", "_parent", "_dirty", "_table", "_ends", "_base")
+
+    def __init__(self, data):
+        list.__init__(self)
+        self._data = data
+        self._span = data
+        self._parent = None
+        self._dirty = False
+        self._table = None
+        self._ends = None
+        self._base = 0
+
+    @classmethod
+    def loaded(cls, value, span):
+        proxy = cls(None)
+        list.extend(proxy, value)
+        proxy._span = span
+        adopt(proxy)
+        return proxy
+
+    def load(self):
+        data = self._data
+        if data is not None:
+            self._data = None
+            list.extend(self, unpack_variant6(data, True, False, self._table,
+                                              self._ends, self._base)[0])
+            self._ends = None
+            adopt(self)
+        return self
+
+    def is_loaded(self):
+        return self._data is None
+
+    def is_dirty(self):
+        return self._dirty or self._span is None
+
+    def span(self):
+        return self._span
+
+    def __setitem__(self, index, value):
+        if self._data is not None:
+            self.load()
+        if not self._dirty and not (type(index) is int and -len(self) <= index < len(self) and
+                                    same_value(list.__getitem__(self, index), value)):
+            mark_dirty(self)
+        list.__setitem__(self, index, value)
+
+    def __eq__(self, other):
+        self.load()
+        if isinstance(other, (LazyDict, LazyList)):
+            other.load()
+        return list.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __copy__(self):
+        return list(self.load())
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self.load()), memo)
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self.load()),)
+
+for method in ("__getitem__", "__contains__", "__iter__", "__reversed__",
+               "__len__", "__repr__", "__or__", "__ror__", "keys", "values",
+               "items", "get", "copy"):
+    if hasattr(dict, method):
+        setattr(LazyDict, method, loading(getattr(dict, method)))
+
+for method in ("__delitem__", "__ior__", "pop", "popitem", "setdefault",
+               "update", "clear"):
+    if hasattr(dict, method):
+        setattr(LazyDict, method, mutating(getattr(dict, method)))
+
+for method in ("__getitem__", "__contains__", "__iter__", "__reversed__",
+               "__len__", "__repr__", "__add__", "__mul__", "__rmul__",
+               "__lt__", "__le__", "__gt__", "__ge__", "index", "count",
+               "copy"):
+    setattr(LazyList, method, loading(getattr(list, method)))
+
+for method in ("__delitem__", "__iadd__", "__imul__", "append", "extend",
+               "insert", "remove", "pop", "sort", "reverse", "clear"):
+    if hasattr(list, method):
+        setattr(LazyList, method, mutating(getattr(list, method)))
+
+def dict_spans(data):
+    """Map each key of an encoded variant dict to the encoded bytes of its value."""
+    total, offset = read_vlq(data, 0)
+    spans = {}
+    for i in range(total):
+        key = unpack_vlq_str(data[offset:])
+        offset += key[1]
+        end = skip_variant(data, offset)
+        spans[key[0]] = data[offset:end]
+        offset = end
+    return spans
+
+# variant type: proxy class used for it in lazy mode
+lazy_types = {6: LazyList, 7: LazyDict}
+
+def unlazy(var):
+    """Return a copy of a value with every lazy proxy in it fully decoded."""
+    if isinstance(var, dict):
+        return {k: unlazy(v) for k, v in var.items()}
+    elif isinstance(var, list):
+        return [unlazy(v) for v in var]
+    else:
+        return var
+
+# diffs
+#
+# A change is (kind, path, old value, new value) where kind is "added",
+# "removed" or "changed" and path is a tuple of keys. Subtrees neither side
+# has modified since decoding are compared by their original bytes, so two
+# saves are mostly compared at memcmp speed and only the parts that differ
+# are walked.
+
+# lists of things that are told apart by this key rather than position
+keyed_lists = {
+    ("blueprints",): "name"
+}
+
+def same_bytes(old, new):
+    """Check two values are identical using their original bytes, if they have them."""
+    if type(old) is not type(new) or not (type(old) is LazyDict or type(old) is LazyList):
+        return False
+    if old.is_dirty() or new.is_dirty():
+        return False
+    a = old.span()
+    b = new.span()
+    return len(a) == len(b) and bytes(a) == bytes(b)
+
+def diff_values(old, new, path=(), changes=None):
+    """Return the list of changes going from old to new."""
+    if changes is None:
+        changes = []
+    if old is new or same_bytes(old, new):
+        return changes
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old.keys()) | set(new.keys())):
+            if key not in new:
+                changes.append(("removed", path + (key,), old[key], None))
+            elif key not in old:
+                changes.append(("added", path + (key,), None, new[key]))
+            else:
+                diff_values(old[key], new[key], path + (key,), changes)
+    elif isinstance(old, list) and isinstance(new, list):
+        if path in keyed_lists:
+            diff_keyed(old, new, path, keyed_lists[path], changes)
+        elif len(path) == 2 and path[0] == "inventory":
+            diff_slots(old, new, path, changes)
+        else:
+            for i in range(min(len(old), len(new))):
+                diff_values(old[i], new[i], path + (i,), changes)
+            for i in range(len(new), len(old)):
+                changes.append(("removed", path + (i,), old[i], None))
+            for i in range(len(old), len(new)):
+                changes.append(("added", path + (i,), None, new[i]))
+    elif type(old) is not type(new) or old != new:
+        changes.append(("changed", path, old, new))
+    return changes
+
+def diff_slots(old, new, path, changes):
+    """Inventory slots, a different item in a slot is one change."""
+    for i in range(max(len(old), len(new))):
+        o = old[i] if i < len(old) else None
+        n = new[i] if i < len(new) else None
+        if o is n or same_bytes(o, n):
+            continue
+        if isinstance(o, dict) and isinstance(n, dict) and o.get("name") == n.get("name"):
+            diff_values(o, n, path + (i,), changes)
+        elif o is None:
+            changes.append(("added", path + (i,), None, n))
+        elif n is None:
+            changes.append(("removed", path + (i,), o, None))
+        else:
+            changes.append(("changed", path + (i,), o, n))
+
+def diff_keyed(old, new, path, key, changes):
+    """Lists like blueprints where order doesn't matter, matched up by key."""
+    old_items = collections.OrderedDict()
+    for item in old:
+        old_items.setdefault(item[key], item)
+    new_items = collections.OrderedDict()
+    for item in new:
+        new_items.setdefault(item[key], item)
+
+    for name in old_items:
+        if name not in new_items:
+            changes.append(("removed", path + (name,), old_items[name], None))
+        else:
+            diff_values(old_items[name], new_items[name], path + (name,), changes)
+    for name in new_items:
+        if name not in old_items:
+            changes.append(("added", path + (name,), None, new_items[name]))
+
+def describe_value(var, limit=60):
+    if isinstance(var, dict) and "name" in var and "count" in var:
+        return "%s x%s" % (var["name"], var["count"])
+    text = "".join(json_chunks(var, JsonFormat()))
+    if len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
+
+def format_changes(changes):
+    """Return a line of text for each change."""
+    lines = []
+    for kind, path, old, new in changes:
+        name = ".".join(str(x) for x in path)
+        if kind == "added":
+            lines.append("+ %s: %s" % (name, describe_value(new)))
+        elif kind == "removed":
+            lines.append("- %s: %s" % (name, describe_value(old)))
+        else:
+            lines.append("~ %s: %s -> %s" % (name, describe_value(old), describe_value(new)))
+    return lines
+
+# streaming JSON
+#
+# These produce the same text as json.dumps(entity, sort_keys=True, ...) but a
+# piece at a time, and proxies that haven't been decoded are converted
+# straight from their bytes without building anything, so exporting a lazily
+# opened save doesn't need the whole entity in memory.
+
+class JsonFormat():
+    """Indent and separators of the JSON being written."""
+    def __init__(self, indent=None):
+        self.indent = indent
+        if indent is None:
+            self.key_separator = ":"
+        else:
+            self.key_separator = ": "
+
+    def newline(self, level):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * level)
+
+def json_scalar(var):
+    if var is None:
+        return "null"
+    elif var is True:
+        return "true"
+    elif var is False:
+        return "false"
+    elif type(var) is str:
+        return encode_basestring_ascii(var)
+    else:
+        # takes care of NaN and the like
+        return json.dumps(var)
+
+def json_container(members, brackets, fmt, level):
+    """Join the chunk generators of a list or dict's members."""
+    first = True
+    for member in members:
+        if first:
+            yield brackets[0] + fmt.newline(level + 1)
+            first = False
+        else:
+            yield "," + fmt.newline(level + 1)
+        yield from member
+    if first:
+        yield brackets
+    else:
+        yield fmt.newline(level) + brackets[1]
+
+def json_member(key, chunks, fmt):
+    yield encode_basestring_ascii(key) + fmt.key_separator
+    yield from chunks
+
+def variant_json(data, offset, fmt, level, variant_type=None):
+    """
+    Yield the variant at offset as JSON, then return the offset after it. If
+    variant_type is given data is just the value without its type.
+    """
+    if variant_type is None:
+        variant_type, offset = read_vlq(data, offset)
+    if variant_type == 6:
+        total, offset = read_vlq(data, offset)
+        if total == 0:
+            yield "[]"
+            return offset
+        for i in range(total):
+            yield ("[" if i == 0 else ",") + fmt.newline(level + 1)
+            offset = yield from variant_json(data, offset, fmt, level + 1)
+        yield fmt.newline(level) + "]"
+        return offset
+    elif variant_type == 7:
+        end = skip_value(variant_type, data, offset)
+        spans = dict_spans(data[offset:end])
+        members = (json_member(k, variant_json(spans[k], 0, fmt, level + 1), fmt)
+                   for k in sorted(spans))
+        yield from json_container(members, "{}", fmt, level)
+        return end
+    else:
+        value = variant_types[variant_type][0](data[offset:])
+        yield json_scalar(value[0])
+        return offset + value[1]
+
+def json_chunks(var, fmt, level=0):
+    """Yield a decoded value as JSON, proxies are read from their bytes if possible."""
+    if type(var) is LazyDict or type(var) is LazyList:
+        if not var.is_loaded():
+            variant_type = 7 if type(var) is LazyDict else 6
+            yield from variant_json(var.span(), 0, fmt, level, variant_type)
+            return
+    if isinstance(var, dict):
+        members = (json_member(k, json_chunks(var[k], fmt, level + 1), fmt)
+                   for k in sorted(var.keys()))
+        yield from json_container(members, "{}", fmt, level)
+    elif isinstance(var, list):
+        members = (json_chunks(x, fmt, level + 1) for x in var)
+        yield from json_container(members, "[]", fmt, level)
+    else:
+        yield json_scalar(var)
+
+def write_json(var, fp, indent=4):
+    """Write a value to a text file object as sorted, indented JSON."""
+    for chunk in json_chunks(var, JsonFormat(indent)):
+        fp.write(chunk)
+
+def iter_json_items(fp, read_size=64 * 1024):
+    """
+    Read a JSON object from a text file object, yielding its (key, value)
+    pairs one at a time so only one top level value is held as text.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    offset = 0
+    eof = False
+
+    def fill(size):
+        nonlocal buffer, offset, eof
+        data = fp.read(size)
+        if data == "":
+            eof = True
+        buffer = buffer[offset:] + data
+        offset = 0
+
+    def skip_space():
+        nonlocal offset
+        while True:
+            while offset < len(buffer) and buffer[offset] in " \t\r\n":
+                offset += 1
+            if offset < len(buffer) or eof:
+                return
+            fill(read_size)
+
+    def expect(chars):
+        nonlocal offset
+        skip_space()
+        if offset >= len(buffer) or buffer[offset] not in chars:
+            raise ValueError("Expected %s at character %d" % (" or ".join(chars), offset))
+        offset += 1
+        return buffer[offset - 1]
+
+    def decode():
+        nonlocal offset
+        skip_space()
+        size = read_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, offset)
+                # a number might continue in the next read
+                if end < len(buffer) or eof:
+                    offset = end
+                    return value
+            except ValueError:
+                if eof:
+                    raise
+            # value isn't all here yet, read more (a bigger bit each time)
+            fill(size)
+            size *= 2
+
+    fill(read_size)
+    expect("{")
+    skip_space()
+    if offset < len(buffer) and buffer[offset] == "}":
+        return
+    while True:
+        key = decode()
+        if type(key) is not str:
+            raise ValueError("Expected a string key, got %r" % key)
+        expect(":")
+        yield key, decode()
+        if expect(",}") == "}":
+            return
+
+def read_json(fp, entity):
+    """Update a dict with the JSON object in a text file object, one key at a time."""
+    for key, value in iter_json_items(fp):
+        entity[key] = value
+    return entity
+
+def dump_json_lines(filenames, fp):
+    """
+    Write one compact JSON line per save file with its name and entity.
+    Saves are opened lazily and converted straight from their bytes.
+    """
+    fmt = JsonFormat()
+    for filename in filenames:
+        player = PlayerSave(filename, lazy=True)
+        fp.write('{"file":%s,"entity":' % encode_basestring_ascii(filename))
+        for chunk in json_chunks(player.entity, fmt):
+            fp.write(chunk)
+        fp.write("}\n")
+
+def iter_json_lines(fp):
+    """Yield (file name, entity) from a JSON Lines dump, one save at a time."""
+    for line in fp:
+        if line.strip() == "":
+            continue
+        record = json.loads(line)
+        yield record["file"], record["entity"]
+
 def new_item(name, count, data={}):
     if name is None: return None
 
@@ -336,18 +1005,171 @@ def pack_color_directives(colors):
 class WrongSaveVer(Exception):
     pass
 
+class Group():
+    """Context manager that makes every change in its block one undo step."""
+    def __init__(self, history):
+        self.history = history
+
+    def __enter__(self):
+        self.history.depth += 1
+        return self
+
+    def __exit__(self, *args):
+        history = self.history
+        history.depth -= 1
+        if history.depth == 0 and len(history.pending) > 0:
+            history.push(history.pending)
+            history.pending = []
+        return False
+
+class Pause():
+    """Context manager that stops its block being recorded."""
+    def __init__(self, history):
+        self.history = history
+
+    def __enter__(self):
+        self.history.paused += 1
+        return self
+
+    def __exit__(self, *args):
+        self.history.paused -= 1
+        return False
+
+class Coalesce():
+    """
+    Context manager marking changes in its block as coming from one
+    continuous input, like a text box or slider, so they can be merged.
+    """
+    def __init__(self, history, key):
+        self.history = history
+        self.key = key
+
+    def __enter__(self):
+        self.outer = self.history.coalesce_key
+        self.history.coalesce_key = self.key
+        return self
+
+    def __exit__(self, *args):
+        self.history.coalesce_key = self.outer
+        return False
+
+class History():
+    """
+    Undo/redo stack of changes made to a PlayerSave.
+
+    A step is a list of (path, old value, new value). Values are kept by
+    reference rather than copied, so a step costs only the values that were
+    replaced, and everything else stays shared with the live entity. This
+    relies on setters being given new values instead of containers that
+    were already changed in place.
+    """
+    def __init__(self, limit=200):
+        self.undo_steps = collections.deque(maxlen=limit)
+        self.redo_steps = []
+        self.pending = []
+        self.depth = 0
+        self.paused = 0
+        self.last_time = 0
+        # input the changes being recorded come from, see coalescing
+        self.coalesce_key = None
+        self.last_key = None
+
+    # repeated changes to the same values from the same input this close
+    # together are merged into one step, e.g. typing a name or dragging a
+    # slider
+    coalesce_time = 1.0
+
+    def record(self, path, old, new):
+        if self.paused:
+            return
+        self.pending.append((path, old, new))
+        if self.depth == 0:
+            self.push(self.pending)
+            self.pending = []
+
+    def push(self, step):
+        now = time.time()
+        key = self.coalesce_key
+        if (key is not None and key == self.last_key and len(self.undo_steps) > 0 and
+                now - self.last_time < self.coalesce_time and
+                [x[0] for x in self.undo_steps[-1]] == [x[0] for x in step]):
+            last = self.undo_steps[-1]
+            self.undo_steps[-1] = [(x[0], x[1], y[2]) for x, y in zip(last, step)]
+        else:
+            self.undo_steps.append(step)
+        self.last_time = now
+        self.last_key = key
+        self.redo_steps = []
+
+    def group(self):
+        return Group(self)
+
+    def coalescing(self, key):
+        """
+        Tag changes with the input they come from. Only steps with the same
+        key are merged, so separate actions on the same values stay
+        separate undo steps.
+        """
+        return Coalesce(self, key)
+
+    def pause(self):
+        return Pause(self)
+
+    def can_undo(self):
+        return len(self.undo_steps) > 0
+
+    def can_redo(self):
+        return len(self.redo_steps) > 0
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps = []
+
+# stands in for a key that wasn't there before a change
+missing = object()
+
+def grouped(setter):
+    """Make everything a PlayerSave setter changes a single undo step."""
+    def wrapper(self, *args, **kwargs):
+        with self.history.group():
+            return setter(self, *args, **kwargs)
+    wrapper.__name__ = setter.__name__
+    wrapper.__doc__ = setter.__doc__
+    return wrapper
+
 class PlayerSave():
-    def __init__(self, filename):
+    def __init__(self, filename, lazy=False, intern=False, track=True):
         self.data = {}
+        self.history = History()
+        # decode entity subtrees only when they're used
+        self.lazy = lazy
+        # share keys and scalars for tools holding many saves at once.
+        # intern=True shares them within this save, or pass a dict to share
+        # them with every save given the same one. it lasts as long as the
+        # caller keeps it
+        if isinstance(intern, dict):
+            self.table = intern
+        elif intern:
+            self.table = {}
+        else:
+            self.table = None
+        # dicts and lists keep their original bytes so export only has to
+        # encode what was changed and diffs skip equal subtrees. that costs a
+        # memoryview per container and keeps the whole file in memory, pass
+        # track=False for plain dicts and lists when neither is needed. lazy
+        # saves always track
+        self.track = track or lazy
         self.import_save(filename)
         self.filename = filename
         # this is just to shorten variable names, we copy it back on export
         self.entity = self.data["save"]["data"]
 
+    @tracing.traced
     def import_save(self, filename=None):
         logging.debug("Init save import: " + filename)
         save_file = open(filename, mode="rb")
-        save_data = save_file.read()
+        # a memoryview so slicing doesn't copy, lazy values keep a slice of it
+        save_data = memoryview(save_file.read())
 
         # do a version check first
         try:
@@ -366,7 +1188,7 @@ class PlayerSave():
         for var in data_format:
             logging.debug("Unpacking " + var[0])
             try:
-                unpacked = unpack_var(var, save_data[offset:])
+                unpacked = unpack_var(var, save_data[offset:], self.lazy, self.track, self.table)
             except:
                 msg = "Save file is corrupt"
                 logging.exception(msg)
@@ -377,14 +1199,16 @@ class PlayerSave():
 
         save_file.close()
 
+    @tracing.traced
     def export_save(self, filename=None):
         logging.debug("Init save export: " + self.filename)
         self.data["save"]["data"] = self.entity
-        player_data = b""
+        player_data = []
 
         for var in data_format:
             logging.debug("Packing " + var[0])
-            player_data += pack_var(var, self.data[var[0]])
+            player_data.append(pack_var(var, self.data[var[0]]))
+        player_data = b"".join(player_data)
 
         if filename != None:
             save_file = open(filename, "wb")
@@ -397,6 +1221,91 @@ class PlayerSave():
     def dump(self):
         pprint(self.data)
 
+    def value_spans(self):
+        """
+        Encoded bytes of each top level entity value as it was in the file,
+        empty if the save isn't tracked.
+        """
+        if type(self.entity) is not LazyDict:
+            return {}
+        return dict_spans(self.entity.span())
+
+    def value_digests(self):
+        """
+        SHA-1 of each top level entity value as it was in the file, to tell
+        which ones a later version of the file changed without keeping this
+        one around.
+        """
+        return {k: hashlib.sha1(v).digest() for k, v in self.value_spans().items()}
+
+    def changed_keys(self, other):
+        """Return the top level entity keys whose values differ between two saves."""
+        mine = self.value_spans()
+        theirs = other.value_spans()
+        changed = []
+        for key in sorted(set(mine) | set(theirs)):
+            if key not in mine or key not in theirs or bytes(mine[key]) != bytes(theirs[key]):
+                changed.append(key)
+        return changed
+
+    def diff(self, other=None):
+        """
+        Return the changes going from other (by default the save as it is on
+        disk now) to this one.
+        """
+        if other is None:
+            other = PlayerSave(self.filename, lazy=True)
+        return diff_values(other.entity, self.entity)
+
+    def put(self, path, value):
+        """Set the value at a path of keys in the entity and return the old one."""
+        target = self.entity
+        for key in path[:-1]:
+            target = target[key]
+        if isinstance(target, dict):
+            old = target.get(path[-1], missing)
+        else:
+            old = target[path[-1]]
+        if value is missing:
+            del target[path[-1]]
+        else:
+            target[path[-1]] = value
+        return old
+
+    def set(self, path, value):
+        """Like put, but recorded in the undo history if it changes anything."""
+        old = self.put(path, value)
+        if same_value(old, value) or (isinstance(value, (list, dict)) and old == value):
+            return
+        self.history.record(path, old, value)
+
+    def undo(self):
+        """Revert the last step and return the paths it changed."""
+        if not self.history.can_undo():
+            return []
+        step = self.history.undo_steps.pop()
+        with self.history.pause():
+            for path, old, new in reversed(step):
+                self.put(path, old)
+        self.history.redo_steps.append(step)
+        # don't merge the next change into a step that was just undone
+        self.history.last_time = 0
+        self.history.last_key = None
+        return [x[0] for x in step]
+
+    def redo(self):
+        """Reapply the last undone step and return the paths it changed."""
+        if not self.history.can_redo():
+            return []
+        step = self.history.redo_steps.pop()
+        with self.history.pause():
+            for path, old, new in step:
+                self.put(path, new)
+        self.history.undo_steps.append(step)
+        self.history.last_time = 0
+        self.history.last_key = None
+        return [x[0] for x in step]
+
     # getters
     def get_header(self):
         return unpack_str(self.data["header"])
@@ -535,10 +1444,10 @@ class PlayerSave():
 
     # here be setters
     def set_blueprints(self, blueprints):
-        self.entity["blueprints"] = blueprints
+        self.set(("blueprints",), blueprints)
 
     def set_name(self, name):
-        self.entity["identity"]["name"] = name
+        self.set(("identity", "name"), name)
 
     # TODO: at some point we need to run through and replace all "race"
     # references to species
@@ -546,120 +1455,120 @@ class PlayerSave():
         if race == "":
             logging.warning("Attempted to save empty race, asset index may be corrupt")
             return
-        self.entity["identity"]["species"] = race.lower()
+        self.set(("identity", "species"), race.lower())
 
     def set_pixels(self, pixels):
-        self.entity["inventory"]["money"] = int(pixels)
+        self.set(("inventory", "money"), int(pixels))
 
     def set_description(self, description):
-        self.entity["description"] = description
+        self.set(("description",), description)
 
     def set_gender(self, gender):
-        self.entity["identity"]["gender"] = gender.lower()
+        self.set(("identity", "gender"), gender.lower())
 
     # stats
     def set_health(self, current, max):
-        self.entity["status"]["healthSchema"]["value"] = float(current)
-        self.entity["status"]["healthSchema"]["max"] = float(max)
+        self.set(("status", "healthSchema", "value"), float(current))
+        self.set(("status", "healthSchema", "max"), float(max))
 
     def set_max_health(self, max):
-        self.entity["statusParameters"]["baseMaxHealth"] = float(max)
+        self.set(("statusParameters", "baseMaxHealth"), float(max))
 
     def set_energy(self, current, max):
-        self.entity["status"]["energySchema"]["max"] = float(max)
-        self.entity["status"]["energySchema"]["value"] = float(current)
+        self.set(("status", "energySchema", "max"), float(max))
+        self.set(("status", "energySchema", "value"), float(current))
 
     def set_max_energy(self, max):
-        self.entity["statusParameters"]["baseMaxEnergy"] = float(max)
+        self.set(("statusParameters", "baseMaxEnergy"), float(max))
 
     def set_food(self, current, max):
-        self.entity["status"]["foodSchema"]["max"] = float(max)
-        self.entity["status"]["foodSchema"]["value"] = float(current)
+        self.set(("status", "foodSchema", "max"), float(max))
+        self.set(("status", "foodSchema", "value"), float(current))
 
     def set_max_food(self, max):
-        self.entity["statusParameters"]["baseMaxFood"] = float(max)
+        self.set(("statusParameters", "baseMaxFood"), float(max))
 
     def set_max_warmth(self, max):
-        self.entity["status"]["warmthSchema"]["max"] = float(max)
-        self.entity["statusParameters"]["baseMaxWarmth"] = float(max)
+        self.set(("status", "warmthSchema", "max"), float(max))
+        self.set(("statusParameters", "baseMaxWarmth"), float(max))
 
     def set_breath(self, current, max):
-        self.entity["status"]["breathSchema"]["max"] = float(max)
-        self.entity["status"]["breathSchema"]["value"] = float(current)
+        self.set(("status", "breathSchema", "max"), float(max))
+        self.set(("status", "breathSchema", "value"), float(current))
 
     def set_max_breath(self, max):
-        self.entity["status"]["breathSchema"]["max"] = float(max)
-        self.entity["statusParameters"]["baseMaxBreath"] = float(max)
+        self.set(("status", "breathSchema", "max"), float(max))
+        self.set(("statusParameters", "baseMaxBreath"), float(max))
 
     def set_energy_regen(self, rate):
-        self.entity["statusParameters"]["energyReplenishmentRate"] = float(rate)
+        self.set(("statusParameters", "energyReplenishmentRate"), float(rate))
 
     def set_main_bag(self, bag):
-        self.entity["inventory"]["bag"] = bag
+        self.set(("inventory", "bag"), bag)
 
     def set_tile_bag(self, bag):
-        self.entity["inventory"]["tileBag"] = bag
+        self.set(("inventory", "tileBag"), bag)
 
     def set_action_bar(self, bag):
-        self.entity["inventory"]["actionBar"] = bag
+        self.set(("inventory", "actionBar"), bag)
 
     def set_wieldable(self, bag):
-        self.entity["inventory"]["wieldable"] = bag
+        self.set(("inventory", "wieldable"), bag)
 
     def set_head(self, main, glamor):
-        self.entity["inventory"]["equipment"][0] = main
-        self.entity["inventory"]["equipment"][4] = glamor
+        self.set(("inventory", "equipment", 0), main)
+        self.set(("inventory", "equipment", 4), glamor)
 
     def set_chest(self, main, glamor):
-        self.entity["inventory"]["equipment"][1] = main
-        self.entity["inventory"]["equipment"][5] = glamor
+        self.set(("inventory", "equipment", 1), main)
+        self.set(("inventory", "equipment", 5), glamor)
 
     def set_legs(self, main, glamor):
-        self.entity["inventory"]["equipment"][2] = main
-        self.entity["inventory"]["equipment"][6] = glamor
+        self.set(("inventory", "equipment", 2), main)
+        self.set(("inventory", "equipment", 6), glamor)
 
     def set_back(self, main, glamor):
-        self.entity["inventory"]["equipment"][3] = main
-        self.entity["inventory"]["equipment"][7] = glamor
+        self.set(("inventory", "equipment", 3), main)
+        self.set(("inventory", "equipment", 7), glamor)
 
     def set_personality(self, idle):
-        self.entity["identity"]["personalityArmIdle"] = idle
+        self.set(("identity", "personalityArmIdle"), idle)
         # self.entity["identity"]["personalityArmOffset"]
         # self.entity["identity"]["personalityHeadOffset"]
-        self.entity["identity"]["personalityIdle"] = idle
+        self.set(("identity", "personalityIdle"), idle)
 
     def set_hair(self, group, type):
-        self.entity["identity"]["hairGroup"] = group
-        self.entity["identity"]["hairType"] = type
+        self.set(("identity", "hairGroup"), group)
+        self.set(("identity", "hairType"), type)
 
     def set_facial_hair(self, group, type):
-        self.entity["identity"]["facialHairGroup"] = group
-        self.entity["identity"]["facialHairType"] = type
+        self.set(("identity", "facialHairGroup"), group)
+        self.set(("identity", "facialHairType"), type)
 
     def set_facial_mask(self, group, type):
-        self.entity["identity"]["facialMaskGroup"] = group
-        self.entity["identity"]["facialMaskType"] = type
+        self.set(("identity", "facialMaskGroup"), group)
+        self.set(("identity", "facialMaskType"), type)
 
     def set_body_directives(self, colors):
-        self.entity["identity"]["bodyDirectives"] = pack_color_directives(colors)
+        self.set(("identity", "bodyDirectives"), pack_color_directives(colors))
 
     def set_emote_directives(self, colors):
-        self.entity["identity"]["emoteDirectives"] = pack_color_directives(colors)
+        self.set(("identity", "emoteDirectives"), pack_color_directives(colors))
 
     def set_hair_directives(self, colors):
-        self.entity["identity"]["hairDirectives"] = pack_color_directives(colors)
+        self.set(("identity", "hairDirectives"), pack_color_directives(colors))
 
     def set_facial_hair_directives(self, colors):
-        self.entity["identity"]["facialHairDirectives"] = pack_color_directives(colors)
+        self.set(("identity", "facialHairDirectives"), pack_color_directives(colors))
 
     def set_facial_mask_directives(self, colors):
-        self.entity["identity"]["facialMaskDirectives"] = pack_color_directives(colors)
+        self.set(("identity", "facialMaskDirectives"), pack_color_directives(colors))
 
     def set_game_mode(self, mode):
-        self.entity["modeType"] = mode
+        self.set(("modeType",), mode)
 
     def set_play_time(self, time):
-        self.entity["playTime"] = float(time)
+        self.set(("playTime",), float(time))
 
     def set_tech_modules(self, techs, equip):
         # this works similar to the equip items in that it needs to be set
@@ -668,12 +1577,42 @@ class PlayerSave():
         # this is where techs start in the equip list
         equip_index = 8
         for tech in equip:
-            self.entity["inventory"]["equipment"][equip_index] = new_item(tech, 1)
+            self.set(("inventory", "equipment", equip_index), new_item(tech, 1))
             equip_index += 1
 
-        self.entity["techController"]["techModules"] = techs
+        self.set(("techController", "techModules"), techs)
+
+# every setter is one undo step, however many values it changes
+for name in list(vars(PlayerSave)):
+    if name.startswith("set_"):
+        setattr(PlayerSave, name, grouped(getattr(PlayerSave, name)))
+
+class PlayerSummary():
+    """What listing a character needs, without holding on to its save."""
+    __slots__ = ("filename", "name", "race", "gender", "uuid")
+
+    def __init__(self, filename, name, race, gender, uuid):
+        self.filename = filename
+        self.name = name
+        # only a handful of different values, keep one copy of each
+        self.race = sys.intern(race)
+        self.gender = sys.intern(gender)
+        self.uuid = uuid
+
+    @classmethod
+    def read(cls, filename):
+        """Summarise a save file, only decoding the identity."""
+        player = PlayerSave(filename, lazy=True)
+        return cls(filename, player.get_name(), player.get_race(),
+                   player.get_gender(), player.get_uuid())
+
+    def open(self):
+        return PlayerSave(self.filename)
+
+    def __repr__(self):
+        return "PlayerSummary(%r, %r)" % (self.filename, self.name)
 
 if __name__ == '__main__':
-    player = PlayerSave(sys.argv[1])
+    player = PlayerSave(sys.argv[1], track=False)
     player.dump()
     print(player.export_save())
@@ -3,7 +3,7 @@
 import logging, logging.handlers, os, sys, traceback, platform
 from PyQt5.QtWidgets import QMessageBox
 
-import config, gui.mainwindow
+import config, tracing, gui.mainwindow
 
 # set up starcheat internal logging
 log_file = os.path.join(config.config_folder, "starcheat.log")
@@ -64,6 +64,8 @@ def main():
     logging.info("starcheat init")
     logging.info("Version: %s", config.STARCHEAT_VERSION)
     logging.info("Platform: %s", platform.system())
+    # --trace [file] / --profile or STARCHEAT_TRACE / STARCHEAT_PROFILE
+    tracing.setup(sys.argv, config.config_folder)
     gui.mainwindow.MainWindow()
 
 if __name__ == "__main__":
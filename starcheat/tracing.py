@@ -0,0 +1,165 @@
+"""
+Opt-in timing spans and profiling
+
+Instrumentation is off by default and costs one flag check per call. Turn it
+on with the --trace/--profile command line flags or the STARCHEAT_TRACE and
+STARCHEAT_PROFILE environment variables. STARCHEAT_TRACE can be set to a file
+name to get the per-session summary as JSON instead of in the log.
+
+Functions are timed with the @traced decorator, or any block with:
+
+with tracing.span("name"):
+    ...
+"""
+
+import os, time, json, logging, atexit, io
+
+enabled = False
+# span name: list of durations in seconds
+spans = {}
+trace_file = None
+profiler = None
+profile_file = None
+
+class Span():
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+null_span = NullSpan()
+
+def record(name, duration):
+    try:
+        spans[name].append(duration)
+    except KeyError:
+        spans[name] = [duration]
+
+def span(name):
+    """Return a context manager that times its block as the named span."""
+    if enabled:
+        return Span(name)
+    else:
+        return null_span
+
+def traced(func):
+    """Decorator that records each call of func as a span named after it."""
+    name = func.__qualname__
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+    wrapper.__name__ = func.__name__
+    wrapper.__qualname__ = name
+    wrapper.__doc__ = func.__doc__
+    wrapper.__wrapped__ = func
+    return wrapper
+
+def percentile(durations, percent):
+    """Nearest rank percentile of a sorted list."""
+    index = int(round(percent / 100.0 * (len(durations) - 1)))
+    return durations[index]
+
+def summary():
+    """Return count, total, p50 and p99 (in seconds) of every recorded span."""
+    result = {}
+    for name, durations in spans.items():
+        durations = sorted(durations)
+        result[name] = {
+            "count": len(durations),
+            "total": sum(durations),
+            "p50": percentile(durations, 50),
+            "p99": percentile(durations, 99)
+        }
+    return result
+
+def format_summary(result):
+    lines = ["%-40s %8s %10s %10s %10s" % ("span", "count", "total", "p50", "p99")]
+    for name in sorted(result, key=lambda x: result[x]["total"], reverse=True):
+        s = result[name]
+        lines.append("%-40s %8d %9.3fs %9.2fms %9.2fms" % (name, s["count"], s["total"],
+                                                           s["p50"] * 1000, s["p99"] * 1000))
+    return "\n".join(lines)
+
+def enable(filename=None, profile=None):
+    """
+    Start recording spans. The session summary is written to filename (or the
+    log) on exit, and if profile is set the whole session is also run under
+    cProfile with stats dumped to that file.
+    """
+    global enabled, trace_file, profiler, profile_file
+    if not enabled:
+        atexit.register(report)
+    enabled = True
+    trace_file = filename
+
+    if profile and profiler is None:
+        import cProfile
+        profile_file = profile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+def setup(argv, folder):
+    """Enable tracing from command line flags or environment variables."""
+    trace = os.environ.get("STARCHEAT_TRACE", "")
+    profile = os.environ.get("STARCHEAT_PROFILE", "")
+
+    if "--trace" in argv:
+        index = argv.index("--trace")
+        if index + 1 < len(argv) and not argv[index + 1].startswith("-"):
+            trace = argv[index + 1]
+        else:
+            trace = trace or "1"
+    if "--profile" in argv:
+        profile = profile or "1"
+
+    if trace == "" and profile == "":
+        return
+
+    if trace in ("", "1"):
+        trace = None
+    if profile == "1":
+        profile = os.path.join(folder, "starcheat.prof")
+    enable(trace, profile or None)
+    logging.info("Tracing enabled")
+
+def report():
+    """Write the session summary (and profiler stats) out."""
+    global profiler
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        import pstats
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats("cumulative").print_stats(25)
+        logging.info("Profile written to %s\n%s", profile_file, stats_text.getvalue())
+        profiler = None
+
+    result = summary()
+    if trace_file is None:
+        logging.info("Trace summary:\n%s", format_summary(result))
+    else:
+        try:
+            with open(trace_file, "w") as f:
+                json.dump(result, f, sort_keys=True, indent=4, separators=(',', ': '))
+            logging.info("Trace summary written to %s", trace_file)
+        except OSError:
+            logging.exception("Unable to write trace file %s", trace_file)
+            logging.info("Trace summary:\n%s", format_summary(result))
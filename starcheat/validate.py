@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Find items, blueprints and techs in saves that aren't in the asset index
+
+Usually left behind by a removed mod. All the indexed names are loaded into
+sets once, then each save is checked in one pass over its bags, equipment,
+blueprints and tech modules. From the command line:
+
+$ python ./validate.py [--strip] [--dry-run] <.player files or folders>
+"""
+
+import os, logging
+from optparse import OptionParser
+
+import saves
+
+class SaveValidator():
+    def __init__(self, db):
+        """Load every indexed item, blueprint and tech name from an Assets instance."""
+        self.items = set()
+        self.blueprints = set()
+        self.techs = set()
+
+        c = db.db.cursor()
+        c.execute("select type, key, name from assets where type in ('item', 'blueprint', 'tech')")
+        for asset_type, key, name in c.fetchall():
+            if asset_type == "item":
+                self.items.add(name)
+                # tech items are indexed as <name>-chip, but equipped chips
+                # are saved under their plain itemName
+                if key.endswith(".techitem") and name.endswith("-chip"):
+                    self.items.add(name[:-len("-chip")])
+            elif asset_type == "blueprint":
+                self.blueprints.add(name)
+            else:
+                self.techs.add(key)
+                self.techs.add(name)
+
+    def known_item(self, name):
+        return name in self.items
+
+    def known_blueprint(self, name):
+        # recipes are named after what they make
+        return name in self.blueprints or name in self.items
+
+    def known_tech(self, module_path):
+        if module_path in self.techs:
+            return True
+        return os.path.basename(module_path).split(".")[0] in self.techs
+
+    def check(self, player):
+        """
+        Return a list of (kind, path, name) for everything in the player that
+        isn't indexed.
+        """
+        problems = []
+
+        inventory = player.entity.get("inventory", {})
+        for bag in sorted(inventory.keys()):
+            slots = inventory[bag]
+            if not isinstance(slots, list):
+                continue
+            for i in range(len(slots)):
+                item = slots[i]
+                if isinstance(item, dict) and item.get("name", "") != "":
+                    if not self.known_item(item["name"]):
+                        problems.append(("item", ("inventory", bag, i), item["name"]))
+
+        for blueprint in player.entity.get("blueprints", []):
+            if not self.known_blueprint(blueprint["name"]):
+                problems.append(("blueprint", ("blueprints", blueprint["name"]), blueprint["name"]))
+
+        modules = player.entity.get("techController", {}).get("techModules", [])
+        for i in range(len(modules)):
+            module_path = modules[i].get("modulePath", "")
+            if not self.known_tech(module_path):
+                problems.append(("tech", ("techController", "techModules", i), module_path))
+
+        return problems
+
+    def strip(self, player, problems=None):
+        """
+        Remove everything check() found from the player, as one undo step.
+        Returns the problems that were removed.
+        """
+        if problems is None:
+            problems = self.check(player)
+        if len(problems) == 0:
+            return problems
+
+        with player.history.group():
+            bags = {}
+            for kind, path, name in problems:
+                if kind == "item":
+                    bag = path[1]
+                    if bag not in bags:
+                        bags[bag] = list(player.entity["inventory"][bag])
+                    bags[bag][path[2]] = None
+            for bag in bags:
+                player.set(("inventory", bag), bags[bag])
+
+            unknown = set(x[2] for x in problems if x[0] == "blueprint")
+            if len(unknown) > 0:
+                player.set(("blueprints",), [x for x in player.get_blueprints()
+                                             if x["name"] not in unknown])
+
+            unknown = set(x[2] for x in problems if x[0] == "tech")
+            if len(unknown) > 0:
+                modules = player.entity["techController"]["techModules"]
+                player.set(("techController", "techModules"),
+                           [x for x in modules if x.get("modulePath", "") not in unknown])
+        return problems
+
+def format_problems(problems):
+    return ["unknown %s %s at %s" % (kind, name, ".".join(str(x) for x in path))
+            for kind, path, name in problems]
+
+def main():
+    parser = OptionParser(usage="%prog [options] <.player files or folders>",
+                          description="finds unknown items, blueprints and techs in starbound saves")
+    parser.add_option("-s", "--strip", dest="strip", action="store_true",
+                      help="remove anything unknown from the saves")
+    parser.add_option("-d", "--dry-run", dest="dry_run", action="store_true",
+                      help="with --strip, report what would be removed without writing anything")
+    parser.add_option("-b", "--backup-folder", dest="backup_folder",
+                      help="back up each save to this backup store before writing it")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # these need the full starcheat environment
+    import assets, backups, batch
+    from config import Config
+
+    if len(args) == 0:
+        args = [Config().read("player_folder")]
+    db = assets.Assets(Config().read("assets_db"), Config().read("starbound_folder"))
+    validator = SaveValidator(db)
+
+    total = 0
+    for filename in batch.find_saves(args):
+        try:
+            player = saves.PlayerSave(filename, lazy=True)
+            problems = validator.check(player)
+        except (saves.WrongSaveVer, OSError) as err:
+            print("error      %s: %s" % (filename, err))
+            continue
+
+        total += len(problems)
+        print("%-10s %s (%s)" % ("ok" if len(problems) == 0 else "%d unknown" % len(problems),
+                                 filename, player.get_name()))
+        for line in format_problems(problems):
+            print("    " + line)
+
+        if options.strip and len(problems) > 0 and not options.dry_run:
+            validator.strip(player, problems)
+            if options.backup_folder is not None:
+                backups.BackupStore(options.backup_folder).backup(filename)
+            # written next to it first, so an interrupted strip can't leave
+            # a truncated save
+            temp = filename + ".tmp"
+            player.export_save(temp)
+            os.replace(temp, filename)
+
+    if options.strip and not options.dry_run:
+        print("%d unknown entries removed" % total)
+    else:
+        print("%d unknown entries found" % total)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Notice when save files are changed by something else
+
+Starbound rewrites .player files while it's running. This just polls stat()
+which is cheap enough to do every couple of seconds and works the same
+everywhere.
+"""
+
+import os, logging
+
+def stat_key(filename):
+    """Something that changes whenever the file is written, None if it's gone."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+class Watcher():
+    def __init__(self, filename, folder=None):
+        self.filename = filename
+        self.folder = folder
+        self.reset()
+
+    def folder_state(self):
+        if self.folder is None:
+            return None
+        try:
+            names = [x for x in os.listdir(self.folder) if x.endswith(".player")]
+        except OSError:
+            return None
+        return {x: stat_key(os.path.join(self.folder, x)) for x in names}
+
+    def reset(self):
+        """Take the current state of the file and folder as unchanged."""
+        self.file_state = stat_key(self.filename)
+        self.players = self.folder_state()
+
+    def file_changed(self):
+        """Check if the watched file was written since the last reset."""
+        return stat_key(self.filename) != self.file_state
+
+    def folder_changes(self):
+        """
+        Return (added, removed, modified) player file names since last call,
+        not counting the watched file itself.
+        """
+        players = self.folder_state()
+        if players is None or self.players is None:
+            self.players = players
+            return [], [], []
+
+        own = os.path.basename(self.filename)
+        added = sorted(x for x in players if x not in self.players)
+        removed = sorted(x for x in self.players if x not in players)
+        modified = sorted(x for x in players if x in self.players and x != own and
+                          players[x] != self.players[x])
+        if len(added) > 0 or len(removed) > 0:
+            logging.debug("Player folder changed: %d added, %d removed", len(added), len(removed))
+        self.players = players
+        return added, removed, modified